@@ -1,5 +1,9 @@
-from video_compressor import VideoCompressor
+from video_compressor import VideoCompressor, JobQueue, JobWorkerPool
+
+queue = JobQueue('./jobs.sqlite')
 
 input = VideoCompressor(input='/Users/nicolaslenselle/Downloads/pexel.mp4')
-input.exportCollection('./pexel.mp4', input.WebSettings)
-input.codecPreset('h264WebVBR').exportCollection('./withcodec.mp4', input.WebSettings)
\ No newline at end of file
+queue.put(input.options(), './pexel.mp4', settings=input.WebSettings, key='pexel')
+queue.put(input.codecPreset('h264WebVBR').options(), './withcodec.mp4', settings=input.WebSettings, key='withcodec')
+
+JobWorkerPool(queue, workers=2).run()
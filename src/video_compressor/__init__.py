@@ -10,4 +10,7 @@ except DistributionNotFound:
 finally:
     del get_distribution, DistributionNotFound
 
-from .video import VideoCompressor, VideoInfo, VideoInfoCollection
+from .video import VideoCompressor, VideoInfo, VideoInfoCollection, AsyncVideoInfo
+from .cache import ProbeCache, ExportCache
+from .jobs import JobQueue, JobWorkerPool
+from .adapters.runner import ProcessRunner
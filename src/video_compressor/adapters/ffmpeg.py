@@ -1,17 +1,151 @@
 from shutil import which
-import subprocess
+from functools import lru_cache
+from contextlib import contextmanager, ExitStack
+import hashlib
+import asyncio
+import tempfile
+import threading
+import weakref
+import time
 import os
+import re
 import json
+from fractions import Fraction
 
 from ..exceptions import MissingLibraryError, InvalidVideoInput
+from .mp4 import mp4BoxParser
+from .runner import ProcessRunner
+from ..index import PacketIndex
 
 
-def process(command):
-    process = subprocess.run(command, shell=True, stdout=subprocess.PIPE)
-    return (
-        (process.stdout or b'').decode("utf-8"),
-        (process.stderr or b'').decode("utf-8")
-    )
+INTEGRITY_LEVELS = ('none', 'header', 'sampled', 'full')
+
+PASSLOG_LOCKS = {}
+PASSLOG_LOCKS_GUARD = threading.Lock()
+PASSLOG_ASYNC_LOCKS = weakref.WeakKeyDictionary()
+
+
+@lru_cache(maxsize=None)
+def binary_version(bin):
+    return ProcessRunner().run([bin, '-version'], check=False).text.split('\n', 1)[0].strip()
+
+
+class ffmpegProgress():
+
+    def __init__(self, values, durationInMicroseconds=None, elapsed=0):
+        self.values = values
+        self.durationInMicroseconds = durationInMicroseconds
+        self.elapsed = elapsed
+
+    def number(self, key, cast=float, suffix=''):
+        value = self.values.get(key, '').strip()
+        if suffix and value.endswith(suffix):
+            value = value[:-len(suffix)]
+        try:
+            return cast(value)
+        except ValueError:
+            return None
+
+    @property
+    def frame(self):
+        return self.number('frame', int)
+
+    @property
+    def fps(self):
+        return self.number('fps')
+
+    @property
+    def out_time(self):
+        return self.number('out_time_us', int)
+
+    @property
+    def bitrate(self):
+        kbits = self.number('bitrate', suffix='kbits/s')
+        return round(kbits * 1000) if kbits is not None else None
+
+    @property
+    def speed(self):
+        return self.number('speed', suffix='x')
+
+    @property
+    def done(self):
+        return self.values.get('progress') == 'end'
+
+    @property
+    def percent(self):
+        if self.done:
+            return 100.0
+        if not self.durationInMicroseconds or self.out_time is None:
+            return None
+        return min(100.0, 100 * self.out_time / self.durationInMicroseconds)
+
+    @property
+    def eta(self):
+        if self.done:
+            return 0.0
+        if not self.durationInMicroseconds or self.out_time is None or not self.speed:
+            return None
+        return max(0.0, (self.durationInMicroseconds - self.out_time) / 1000 / 1000 / self.speed)
+
+
+def parse_progress(lines, durationInMicroseconds=None):
+    started = time.monotonic()
+    values = {}
+    for line in lines:
+        key, sep, value = line.strip().partition('=')
+        if not sep:
+            continue
+        values[key] = value
+        if key == 'progress':
+            yield ffmpegProgress(values, durationInMicroseconds, elapsed=time.monotonic() - started)
+            values = {}
+
+
+def parse_quality(output):
+    ssim = re.search(r'SSIM .*All:([0-9.]+)', output)
+    psnr = re.search(r'PSNR .*average:([0-9.]+|inf)', output)
+    if ssim is None or psnr is None:
+        raise InvalidVideoInput(output.strip().splitlines()[-1] if output.strip() else 'Quality measure failed')
+    return float(ssim.group(1)), float(psnr.group(1))
+
+
+def select_times(times):
+    return '+'.join(f'gte(t,{t})*(isnan(prev_t)+lt(prev_t,{t}))' for t in times)
+
+
+def select_interval(interval):
+    return f'isnan(prev_t)+gt(floor(t/{interval}),floor(prev_t/{interval}))'
+
+
+def parse_showinfo(output):
+    return [float(t) for t in re.findall(r'Parsed_showinfo.* pts_time:([0-9.]+)', output)]
+
+
+def passlog_lock(passlogfile):
+    with PASSLOG_LOCKS_GUARD:
+        return PASSLOG_LOCKS.setdefault(passlogfile, threading.Lock())
+
+
+def passlog_lock_async(passlogfile):
+    # asyncio locks belong to an event loop, so they are kept per running loop
+    locks = PASSLOG_ASYNC_LOCKS.setdefault(asyncio.get_running_loop(), {})
+    return locks.setdefault(passlogfile, asyncio.Lock())
+
+
+@contextmanager
+def staged(output):
+    # ffmpeg writes next to the output and the file is only moved into place once complete,
+    # so a crashed or failed encode never leaves a partial file under the output name
+    directory, name = os.path.split(os.path.abspath(output))
+    root, ext = os.path.splitext(name)
+    fd, staging = tempfile.mkstemp(dir=directory, prefix=f'.{root}-', suffix=f'.partial{ext}')
+    os.close(fd)
+    try:
+        yield staging
+        os.replace(staging, output)
+    finally:
+        if os.path.exists(staging):
+            os.remove(staging)
 
 
 def check_bin(bin):
@@ -32,27 +166,90 @@ class ffprobeCmdBuilder():
 
     @property
     def ffprobe(self):
-        return f"{self.bin} -v error -select_streams v:0 -of csv=s=,:p=0"
+        return [self.bin, '-v', 'error']
+
+    @property
+    def source(self):
+        return str(self.input)
+
+    @property
+    def metadata(self):
+        return [*self.ffprobe, '-show_format', '-show_streams', '-of', 'json', self.source]
 
     @property
-    def resolution(self):
-        return f"{self.ffprobe} -show_entries stream=width,height {self.input}"
+    def packets(self):
+        return [
+            *self.ffprobe, '-select_streams', 'v:0', '-show_entries', 'packet=pts_time,dts_time,size,pos,flags',
+            '-of', 'compact=p=0', self.source
+        ]
+
+
+class ffprobeMetadata():
+
+    def __init__(self, data):
+        self.data = data
+
+    @classmethod
+    def fromJSON(cls, payload):
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            data = None
+        if not isinstance(data, dict) or not data.get('streams'):
+            raise InvalidVideoInput(payload)
+        return cls(data)
+
+    @property
+    def format(self):
+        return self.data.get('format', {})
+
+    @property
+    def streams(self):
+        return self.data.get('streams', [])
+
+    def stream(self, codec_type, index=0):
+        streams = [s for s in self.streams if s.get('codec_type') == codec_type]
+        return streams[index] if len(streams) > index else None
+
+    @property
+    def videoStream(self):
+        return self.stream('video') or {}
 
     @property
-    def video_bitrate(self):
-        return f"{self.ffprobe} -show_entries stream=bit_rate {self.input}"
+    def audioStream(self):
+        return self.stream('audio') or {}
 
     @property
-    def audio_bitrate(self):
-        return f"{self.ffprobe} -select_streams a:0 -show_entries stream=bit_rate {self.input}"
+    def width(self):
+        return int(self.videoStream.get('width', 0))
+
+    @property
+    def height(self):
+        return int(self.videoStream.get('height', 0))
+
+    @property
+    def videoBitrate(self):
+        return int(self.videoStream.get('bit_rate') or 0)
+
+    @property
+    def audioBitrate(self):
+        return int(self.audioStream.get('bit_rate') or 0)
 
     @property
     def duration(self):
-        return f"{self.ffprobe} -show_entries stream=duration {self.input}"
+        duration = self.videoStream.get('duration') or self.format.get('duration')
+        return float(duration or 0)
 
     @property
-    def fps(self):
-        return f"{self.ffprobe} -v error -select_streams v -of default=noprint_wrappers=1:nokey=1 -show_entries stream=r_frame_rate {self.input}"
+    def frameRate(self):
+        try:
+            return Fraction(self.videoStream.get('r_frame_rate', '0/1'))
+        except ZeroDivisionError:
+            return Fraction(0)
+
+    @property
+    def size(self):
+        return int(self.format.get('size') or 0)
 
 
 
@@ -70,7 +267,13 @@ class ffmpegCmdBuilder():
         codec_preset=None,
         codec_pass=None,
         quality=None,
-        fps=None
+        fps=None,
+        passlogfile=None,
+        crf=None,
+        copy_video=False,
+        copy_audio=False,
+        filter_order=None,
+        audio_bitrate=None
     ):
         self.input = input
         self.bin = check_bin(bin)
@@ -83,14 +286,28 @@ class ffmpegCmdBuilder():
         self.codec_pass = codec_pass
         self.quality = quality
         self.fps = fps
+        self.passlogfile = passlogfile
+        self.crf = crf
+        self.copy_video = copy_video
+        self.copy_audio = copy_audio
+        self.filter_order = filter_order or ('crop', 'fps', 'scale')
+        self.audio_bitrate = audio_bitrate
+
+    @property
+    def source(self):
+        return str(self.input)
 
     @property
     def ffmpeg(self):
-        return f"{self.bin} -i {self.input}"
+        return [self.bin, '-y', '-i', self.source]
+
+    @property
+    def progress(self):
+        return ['-progress', 'pipe:1', '-nostats']
 
     @property
     def mutefilter(self):
-        return '-an' if self.mute else ''
+        return ['-an'] if self.mute else []
 
     @property
     def scalefilter(self):
@@ -108,7 +325,11 @@ class ffmpegCmdBuilder():
 
     @property
     def bitratefilter(self):
-        return f'-b:v {self.bitrate}' if self.bitrate else ''
+        return ['-b:v', str(self.bitrate)] if self.bitrate else []
+
+    @property
+    def audiobitratefilter(self):
+        return ['-b:a', str(self.audio_bitrate)] if self.audio_bitrate and not self.mute else []
 
     @property
     def fpsfilter(self):
@@ -126,119 +347,413 @@ class ffmpegCmdBuilder():
 
     @property
     def pipestdout(self):
-        return '-f null /dev/null 2>&1'
+        return ['-f', 'null', '-']
 
     @property
     def integrity(self):
-        return f'{self.ffmpeg} -v error {self.pipestdout}'
+        return [*self.ffmpeg, '-v', 'error', *self.pipestdout]
 
-    @property
-    def volumedetect(self):
-        return f"{self.ffmpeg} -af 'volumedetect' {self.pipestdout}"
+    def integritySample(self, start):
+        return [self.bin, '-v', 'error', '-ss', str(start), '-i', self.source, '-frames:v', '1', *self.pipestdout]
 
-    @property
-    def vfilters(self):
+    def rawvideo(self, pix_fmt='rgb24', stride=1):
         filters = list(filter(lambda f: f != '', [
             self.cropfilter,
             self.fpsfilter,
+            f"select='not(mod(n,{stride}))'" if stride > 1 else '',
             self.scalefilter
         ]))
+        vfilters = ['-vf', ','.join(filters)] if filters else []
+        vsync = ['-vsync', 'vfr'] if stride > 1 else []
+        return [*self.ffmpeg, '-v', 'error', '-an', *vfilters, *vsync, '-pix_fmt', pix_fmt, '-f', 'rawvideo', 'pipe:1']
+
+    def pcm(self, sample_rate, channels=1):
+        return [
+            *self.ffmpeg, '-v', 'error', '-vn', '-ac', str(channels), '-ar', str(sample_rate),
+            '-f', 's16le', '-acodec', 'pcm_s16le', 'pipe:1'
+        ]
+
+    @property
+    def vfilterlist(self):
+        filters = {'crop': self.cropfilter, 'fps': self.fpsfilter, 'scale': self.scalefilter}
+        return [filters[name] for name in self.filter_order if filters[name] != '']
+
+    @property
+    def vfilters(self):
+        filters = self.vfilterlist
 
         if len(filters) > 0:
-            return '-vf "'+ ','.join(filters) + '"'
+            return ['-vf', ','.join(filters)]
         else:
-            return ""
+            return []
+
+    @property
+    def filterchain(self):
+        return ','.join(self.vfilterlist) or 'null'
 
     @property
     def filters(self):
-        return f'{self.mutefilter} {self.bitratefilter} {self.vfilters}'
+        return [*self.mutefilter, *self.audiobitratefilter, *self.bitratefilter, *self.passfilter, *self.vfilters]
+
+    @property
+    def twopass(self):
+        return self.codec_pass == 2 and bool(self.bitrate) and bool(self.passlogfile)
+
+    @property
+    def passfilter(self):
+        return ['-pass', '2', '-passlogfile', self.passlogfile] if self.twopass else []
 
     @property
     def crf_quality(self):
-        return ({
-            'low': '-crf 35',
-            'max': '-crf 0' 
-        }).get(self.quality, '-crf 24')
+        if self.crf is not None:
+            return ['-crf', str(self.crf)]
+        return ['-crf', ({
+            'low': '35',
+            'max': '0' 
+        }).get(self.quality, '24')]
 
     @property
     def codec(self):
         if self.codec_preset == 'h264WebVBR':
-            return f"-c:v libx264 {self.crf_quality} -profile:v main -level 4.0"
+            crf = [] if self.twopass else self.crf_quality
+            return ['-c:v', 'libx264', *crf, '-profile:v', 'main', '-level', '4.0']
+        elif self.twopass:
+            return ['-c:v', 'libx264']
+        elif self.crf is not None:
+            return ['-c:v', 'libx264', *self.crf_quality]
         else:
-            return ""
+            return []
+
+    @property
+    def streamcopy(self):
+        video = ['-c:v', 'copy'] if self.copy_video else self.codec
+        audio = ['-c:a', 'copy'] if self.copy_audio and not self.mute else []
+        return [*video, *audio]
 
-    def export(self, output):
-        return f'{self.ffmpeg} {self.codec} {self.filters} {output}'
+    def export(self, output, progress=False):
+        progressflags = self.progress if progress else []
+        return [*self.ffmpeg, *progressflags, *self.streamcopy, *self.filters, output]
 
-    def slice(self, output, start, duration):
-        return f'{self.ffmpeg} {self.codec} {self.filters} -ss {start} -t {duration} {output}'
+    def exportStream(self, format='mp4'):
+        movflags = ['-movflags', 'frag_keyframe+empty_moov+default_base_moof'] if format in ('mp4', 'mov') else []
+        return [*self.ffmpeg, '-v', 'error', *self.codec, *self.filters, *movflags, '-f', format, 'pipe:1']
 
+    def trial(self, start, duration, crf=None, preset=None):
+        if crf is not None:
+            rate = ['-crf', str(crf)]
+        elif self.bitrate:
+            rate = self.bitratefilter
+        else:
+            rate = self.crf_quality if self.codec_preset == 'h264WebVBR' else []
+        presetflags = ['-preset', preset] if preset else []
+        return [
+            self.bin, '-v', 'error', '-ss', str(start), '-t', str(duration), '-i', self.source, *self.vfilters, '-an',
+            '-c:v', 'libx264', *presetflags, *rate, '-f', 'h264', 'pipe:1'
+        ]
 
-class mp4InfoCmdBuilder():
+    def reference(self, output, start, duration):
+        return [
+            self.bin, '-v', 'error', '-ss', str(start), '-t', str(duration), '-i', self.source, *self.vfilters,
+            '-an', '-c:v', 'ffv1', output
+        ]
 
-    def __init__(self, bin, input):
-        self._bin = check_bin(bin)
-        self._input = input
+    def thumbnails(self, pattern, sprite, select, size, layout, exact=True):
+        skip = [] if exact else ['-skip_frame', 'nokey']
+        crop = f'{self.cropfilter},' if self.cropfilter else ''
+        graph = (
+            f"[0:v]{crop}select='{select}',scale={size[0]}:{size[1]},showinfo,split=2[t][s];"
+            f"[s]tile={layout[0]}x{layout[1]}[sprite]"
+        )
+        return [
+            self.bin, '-hide_banner', '-nostats', *skip, '-i', self.source, '-filter_complex', graph,
+            '-map', '[t]', '-vsync', 'vfr', '-start_number', '0', pattern,
+            '-map', '[sprite]', '-frames:v', '1', '-update', '1', sprite
+        ]
 
-    @property
-    def info(self):
-        return f"{self._bin} --format json {self._input}"
+    def sample(self, output):
+        return [*self.ffmpeg, '-v', 'error', *self.codec, *self.filters, output]
+
+    def compare(self, reference):
+        graph = '[0:v][1:v]scale2ref=flags=bicubic[d][r];[d]split[d1][d2];[r]split[r1][r2];[d1][r1]ssim;[d2][r2]psnr'
+        return [self.bin, '-nostats', '-i', self.source, '-i', reference, '-lavfi', graph, '-f', 'null', '-']
+
+    def firstpass(self):
+        return [
+            *self.ffmpeg, *self.codec, *self.bitratefilter, *self.vfilters,
+            '-pass', '1', '-passlogfile', self.passlogfile, '-an', '-f', 'null', '-'
+        ]
+
+    def slice(self, output, start, duration, progress=False, seek=None):
+        progressflags = self.progress if progress else []
+        ffmpeg = self.ffmpeg if seek is None else [self.bin, '-y', '-ss', str(seek), '-i', self.source]
+        return [*ffmpeg, *progressflags, *self.codec, *self.filters, '-ss', str(start), '-t', str(duration), output]
+
+    def segment(self, output_pattern, times, segment_list, copy=True, streams=('-map', '0:v:0')):
+        times = ",".join(map(str, times))
+        if copy:
+            codec = ['-c', 'copy']
+        else:
+            keyframes = ['-force_key_frames', times] if times else []
+            codec = [*self.codec, *self.filters, *keyframes]
+        segment_times = ['-segment_times', times] if times else []
+        return [
+            *self.ffmpeg, *streams, *codec, '-f', 'segment', *segment_times, '-reset_timestamps', '1',
+            '-segment_list', segment_list, '-segment_list_type', 'csv', output_pattern
+        ]
+
+    def concat(self, listfile, output):
+        audio = [] if self.mute else ['-map', '1:a:0?', '-c:a', 'aac', *self.audiobitratefilter]
+        return [
+            self.bin, '-y', '-f', 'concat', '-safe', '0', '-i', listfile, '-i', self.source,
+            '-map', '0:v', '-c:v', 'copy', *audio, output
+        ]
+
+    def fragment(self, output, progress=False):
+        progressflags = self.progress if progress else []
+        return [
+            *self.ffmpeg, '-v', 'error', *progressflags, '-map', '0', '-c', 'copy',
+            '-movflags', 'frag_keyframe+empty_moov+default_base_moof', output
+        ]
+
+    def streamcodec(self, index):
+        options = [f'-c:v:{index}', 'libx264']
+        if self.bitrate:
+            options += [f'-b:v:{index}', str(self.bitrate)]
+        if self.codec_preset == 'h264WebVBR' or self.crf is not None or not self.bitrate:
+            flag, crf = self.crf_quality
+            options += [f'-crf:v:{index}', crf]
+        if self.codec_preset == 'h264WebVBR':
+            options += [f'-profile:v:{index}', 'main', f'-level:v:{index}', '4.0']
+        return options
+
+    def ladder(self, renditions, segment, audio=True):
+        labels = ''.join(f'[s{i}]' for i in range(len(renditions)))
+        graph = [f'[0:v]split={len(renditions)}{labels}']
+        outputs = []
+
+        for i, rendition in enumerate(renditions):
+            graph.append(f'[s{i}]{rendition.filterchain}[v{i}]')
+            outputs += ['-map', f'[v{i}]', *rendition.streamcodec(i)]
+        if audio:
+            outputs += ['-map', '0:a:0', '-c:a', 'aac', '-b:a', '128k']
+
+        # keyframes forced on the same timestamps in every rendition, without scene-cut
+        # keyframes or open GOPs, so segments can be switched at every boundary
+        keyframes = ['-force_key_frames:v', f'expr:gte(t,n_forced*{segment})', '-sc_threshold', '0', '-flags', '+cgop']
+        return [*self.ffmpeg, '-v', 'error', '-filter_complex', ';'.join(graph), *outputs, *keyframes]
+
+    def hls(self, renditions, directory, segment, audio=True):
+        group = ',agroup:audio' if audio else ''
+        streams = [f'v:{i}{group}' for i in range(len(renditions))] + ([f'a:0{group}'] if audio else [])
+        return [
+            *self.ladder(renditions, segment, audio=audio), '-f', 'hls', '-hls_time', str(segment),
+            '-hls_playlist_type', 'vod', '-hls_segment_type', 'fmp4', '-hls_flags', 'independent_segments',
+            '-master_pl_name', 'master.m3u8', '-var_stream_map', ' '.join(streams),
+            '-hls_segment_filename', f'{directory}/stream_%v/segment_%d.m4s', f'{directory}/stream_%v/playlist.m3u8'
+        ]
+
+    def dash(self, renditions, directory, segment, audio=True):
+        sets = 'id=0,streams=v id=1,streams=a' if audio else 'id=0,streams=v'
+        return [
+            *self.ladder(renditions, segment, audio=audio), '-f', 'dash', '-seg_duration', str(segment),
+            '-use_template', '1', '-use_timeline', '1', '-adaptation_sets', sets, f'{directory}/manifest.mpd'
+        ]
+
+    def exportSplit(self, renditions):
+        labels = ''.join(f'[s{i}]' for i in range(len(renditions)))
+        graph = [f'[0:v]split={len(renditions)}{labels}']
+        outputs = []
+
+        for i, (rendition, output) in enumerate(renditions):
+            graph.append(f'[s{i}]{rendition.filterchain}[v{i}]')
+            audio = [] if rendition.mute else ['-map', '0:a:0?', *rendition.audiobitratefilter]
+            outputs += [
+                '-map', f'[v{i}]', *audio, *rendition.codec, *rendition.bitratefilter, *rendition.passfilter, output
+            ]
+
+        return [*self.ffmpeg, '-filter_complex', ';'.join(graph), *outputs]
 
 
 class ffmpegProbeVideoInfoAdapter():
 
-    def __init__(self, input=None, ffmpeg_bin='ffmpeg', ffprobe_bin='ffprobe', mp4info_bin='mp4info', **kwargs):
+    def __init__(
+        self,
+        input=None,
+        ffmpeg_bin='ffmpeg',
+        ffprobe_bin='ffprobe',
+        probe_cache=None,
+        integrity='full',
+        integrity_samples=5,
+        runner=None,
+        **kwargs
+    ):
+        if integrity not in INTEGRITY_LEVELS:
+            raise ValueError(f'integrity must be one of {INTEGRITY_LEVELS}, got {integrity!r}')
         self.input = input
+        self.probe_cache = probe_cache
+        self.runner = runner or ProcessRunner()
+        self.integrity = integrity
+        self.integrity_samples = integrity_samples
         self.ffprobe = ffprobeCmdBuilder(input=input, bin=ffprobe_bin)
         self.ffmpeg = ffmpegCmdBuilder(input=input, bin=ffmpeg_bin)
-        self.mp4Info = mp4InfoCmdBuilder(input=input, bin=mp4info_bin)
+        self._metadata = None
+        self._index = None
+
+    def cached_metadata(self):
+        data = self.probe_cache.get(self.input) if self.probe_cache is not None else None
+        return ffprobeMetadata(data) if data is not None else None
+
+    def store_metadata(self, payload):
+        metadata = ffprobeMetadata.fromJSON(payload)
+        if self.probe_cache is not None:
+            self.probe_cache.set(self.input, metadata.data)
+        return metadata
+
+    @property
+    def metadata(self):
+        if self._metadata is None:
+            self._metadata = self.cached_metadata() or self.store_metadata(self.probeMetadata())
+        return self._metadata
 
-    def check_video_integrity(self, input):
-        trace, error = process(self.ffmpeg.integrity)
-        if 'Invalid data' in trace or 'No such file or directory' in trace:
-            raise InvalidVideoInput(trace)
+    def probeMetadata(self):
+        return self.runner.run(self.ffprobe.metadata, check=False).text
+
+    def probe(self):
+        return self.metadata
+
+    def indexPath(self):
+        digest = hashlib.sha1(os.path.abspath(self.input).encode()).hexdigest()
+        return os.path.join(self.probe_cache.directory, 'index', f'{digest}.npz')
+
+    def packetIndex(self):
+        if self._index is None:
+            index = key = None
+            if self.probe_cache is not None:
+                key = list(self.probe_cache.key(self.input))
+                index = PacketIndex.load(self.indexPath(), key)
+            if index is None:
+                index = PacketIndex.fromLines(self.runner.lines(self.ffprobe.packets))
+                if self.probe_cache is not None:
+                    index.save(self.indexPath(), key)
+            self._index = index
+        return self._index
+
+    async def probeAsync(self, semaphore=None):
+        if self._metadata is None:
+            metadata = self.cached_metadata()
+            if metadata is None:
+                result = await self.runner.runAsync(self.ffprobe.metadata, check=False, semaphore=semaphore)
+                metadata = self.store_metadata(result.text)
+            self._metadata = metadata
+        return self._metadata
+
+    def is_integrity_checked(self, input, level):
+        rank = INTEGRITY_LEVELS.index(level)
+        if rank == 0:
+            return True
+        if self.probe_cache is not None:
+            checked = self.probe_cache.get(input, namespace='integrity')
+            return checked in INTEGRITY_LEVELS and INTEGRITY_LEVELS.index(checked) >= rank
+        return False
+
+    def remember_integrity(self, input, level):
+        if self.probe_cache is not None:
+            self.probe_cache.set(input, level, namespace='integrity')
+
+    def integrity_commands(self, level):
+        if level == 'sampled':
+            duration = self.metadata.duration
+            samples = max(1, self.integrity_samples)
+            return [self.ffmpeg.integritySample(round(duration * i / samples, 3)) for i in range(samples)]
+        if level == 'full':
+            return [self.ffmpeg.integrity]
+        return []
+
+    def check_video_integrity(self, input, level=None):
+        level = level or self.integrity
+        if self.is_integrity_checked(input, level):
+            return
+        if level in ('header', 'sampled'):
+            self.metadata
+        for command in self.integrity_commands(level):
+            self.check_trace(self.runner.run(command, check=False))
+        self.remember_integrity(input, level)
+
+    async def check_video_integrity_async(self, input, level=None, semaphore=None):
+        level = level or self.integrity
+        if self.is_integrity_checked(input, level):
+            return
+        if level in ('header', 'sampled'):
+            await self.probeAsync(semaphore=semaphore)
+        for command in self.integrity_commands(level):
+            self.check_trace(await self.runner.runAsync(command, check=False, semaphore=semaphore))
+        self.remember_integrity(input, level)
+
+    def check_trace(self, result):
+        if result.returncode != 0 or 'Invalid data' in result.log or 'No such file or directory' in result.log:
+            raise InvalidVideoInput(result.log)
 
     def volumedetect(self):
-        volumetrace, error = process(self.ffmpeg.volumedetect)
-        return ('Parsed_volumedetect' in volumetrace)
+        return self.hasAudioStream()
+
+    def hasAudioStream(self):
+        return self.metadata.stream('audio') is not None
+
+    def pcm(self, sample_rate, channels=1, chunk_size=64 * 1024):
+        return self.runner.chunks(self.ffmpeg.pcm(sample_rate, channels), chunk_size=chunk_size)
+
+    def frames(self, buffers, pix_fmt='rgb24', stride=1):
+        return self.runner.readinto(self.ffmpeg.rawvideo(pix_fmt, stride), buffers)
 
     def getResolution(self):
-        resolution, error = process(self.ffprobe.resolution)
-        return map(int, resolution.split(','))
+        return (self.metadata.width, self.metadata.height)
 
     def getVideoBitrate(self):
-        bitrate, error = process(self.ffprobe.video_bitrate)
-        return int(bitrate) if bitrate else 0
+        return self.metadata.videoBitrate
 
     def getAudioBitrate(self):
-        bitrate, error = process(self.ffprobe.audio_bitrate)
-        return int(bitrate) if bitrate else 0
+        return self.metadata.audioBitrate
 
     def getDurationInMicroseconds(self):
-        duration, error = process(self.ffprobe.duration)
-        duration = duration.replace('\n', '')
-        return round(float(duration) * 1000 * 1000)
+        return round(self.metadata.duration * 1000 * 1000)
 
     def getSize(self):
         return os.path.getsize(self.input)
 
     def getFramePerSeconds(self):
-        rate, error = process(self.ffprobe.fps)
-        return round(eval(rate))
+        return round(self.metadata.frameRate)
+
+    def getFrameRate(self):
+        return self.metadata.frameRate
 
     def isFragmented(self):
-        info, error = process(self.mp4Info.info)
-        info = json.loads(info)
-        return info['movie']['fragments']
+        try:
+            return mp4BoxParser(self.input).parse().fragmented
+        except InvalidVideoInput:
+            return False
+
+
+class ffmpegSegmentVideoInfoAdapter(ffmpegProbeVideoInfoAdapter):
+
+    def __init__(self, input=None, startInMicroseconds=0, endInMicroseconds=0, **kwargs):
+        kwargs.setdefault('integrity', 'none')
+        super().__init__(input=input, **kwargs)
+        self.startInMicroseconds = startInMicroseconds
+        self.endInMicroseconds = endInMicroseconds
+
+    def getDurationInMicroseconds(self):
+        return self.endInMicroseconds - self.startInMicroseconds
+
+
 class ffmpegVideoCompressorAdapter():
 
+    stream_copy = True
+
     def __init__(
         self,
         input=None,
         ffmpeg_bin='ffmpeg',
         ffprobe_bin='ffprobe',
-        mp4info_bin='mp4info',
-        mp4fragment_bin='mp4fragment',
         mute=None,
         scale=None,
         bitrate=None,
@@ -247,11 +762,23 @@ class ffmpegVideoCompressorAdapter():
         codec_preset=None,
         quality=None,
         fps=None,
+        codec_pass=None,
+        passlog_dir=None,
+        passlog_max_age=7 * 24 * 3600,
+        crf=None,
+        copy_video=False,
+        copy_audio=False,
+        filter_order=None,
+        audio_bitrate=None,
+        runner=None,
+        **kwargs
     ):
+        self.runner = runner or ProcessRunner()
         self._bin_ffmpeg = ffmpeg_bin
         self._bin_ffprobe = ffprobe_bin
-        self._bin_mp4info = mp4info_bin
-        self._bin_mp4fragment = mp4fragment_bin
+        self._source = None
+        if input is not None and not isinstance(input, (str, os.PathLike)):
+            self._source, input = input, 'pipe:0'
         self._input = input
         self._mute = mute
         self._scale = scale
@@ -261,10 +788,17 @@ class ffmpegVideoCompressorAdapter():
         self._fps = fps
         self._codec_preset = codec_preset
         self._quality = quality
+        self._codec_pass = codec_pass
+        self._crf = crf
+        self._copy_video = copy_video
+        self._copy_audio = copy_audio
+        self._filter_order = filter_order
+        self._audio_bitrate = audio_bitrate
+        self._passlog_dir = passlog_dir or os.path.join(tempfile.gettempdir(), 'video_compressor-passlogs')
+        self._passlog_max_age = passlog_max_age
 
-    @property
-    def ffmpeg(self):
-        return ffmpegCmdBuilder(**{
+    def builder(self, **overrides):
+        options = {
             'input': self._input,
             'bin': self._bin_ffmpeg,
             'mute': self._mute,
@@ -273,18 +807,227 @@ class ffmpegVideoCompressorAdapter():
             'crop_origin': self._crop_origin,
             'crop_size': self._crop_size,
             'codec_preset': self._codec_preset,
+            'codec_pass': self._codec_pass,
             'quality': self._quality,
-            'fps': self._fps
-        })
+            'fps': self._fps,
+            'passlogfile': self.passlogfile,
+            'crf': self._crf,
+            'copy_video': self._copy_video,
+            'copy_audio': self._copy_audio,
+            'filter_order': self._filter_order,
+            'audio_bitrate': self._audio_bitrate
+        }
+        options.update(overrides)
+        return ffmpegCmdBuilder(**options)
+
+    @property
+    def ffmpeg(self):
+        return self.builder()
+
+    def version(self):
+        return f'{type(self).__name__} {binary_version(self._bin_ffmpeg)}'
+
+    @property
+    def passlogfile(self):
+        if self._codec_pass != 2 or not self._bitrate or self._source is not None:
+            return None
+        stat = os.stat(self._input)
+        key = json.dumps([
+            os.path.abspath(self._input), stat.st_size, stat.st_mtime_ns,
+            self._crop_origin, self._crop_size, self._scale, self._fps, self._codec_preset
+        ])
+        return os.path.join(self._passlog_dir, hashlib.sha1(key.encode()).hexdigest())
+
+    def requirePath(self, operation):
+        if self._source is not None:
+            raise InvalidVideoInput(f'{operation} needs a file path input, a streamed input can only be exported')
+
+    def reusePasslog(self, passlogfile):
+        # reused passlogs are touched, so only the ones unused for passlog_max_age are pruned
+        if not os.path.exists(f'{passlogfile}-0.log'):
+            return False
+        for ext in ('.log', '.log.mbtree'):
+            try:
+                os.utime(f'{passlogfile}-0{ext}')
+            except FileNotFoundError:
+                pass
+        return True
 
-    def export(self, output):
-        process(self.ffmpeg.export(output))
+    def prunePasslogs(self):
+        os.makedirs(self._passlog_dir, exist_ok=True)
+        expired = time.time() - self._passlog_max_age
+        for name in os.listdir(self._passlog_dir):
+            path = os.path.join(self._passlog_dir, name)
+            try:
+                if os.stat(path).st_mtime < expired:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
 
-    def slice(self, output, startInMillisecond, durationInMicroseconds):
-        start_str = str(round(startInMillisecond / 1000, 3))
+    def firstpass(self):
+        ffmpeg = self.ffmpeg
+        if not ffmpeg.twopass:
+            return
+        with passlog_lock(ffmpeg.passlogfile):
+            if not self.reusePasslog(ffmpeg.passlogfile):
+                self.prunePasslogs()
+                self.runner.run(ffmpeg.firstpass())
+
+    async def firstpassAsync(self, semaphore=None):
+        ffmpeg = self.ffmpeg
+        if not ffmpeg.twopass:
+            return
+        async with passlog_lock_async(ffmpeg.passlogfile):
+            if not self.reusePasslog(ffmpeg.passlogfile):
+                self.prunePasslogs()
+                await self.runner.runAsync(ffmpeg.firstpass(), semaphore=semaphore)
+
+    def export(self, output, progress=None, durationInMicroseconds=None):
+        self.firstpass()
+        if progress is None:
+            with staged(output) as staging:
+                self.runner.run(self.ffmpeg.export(staging), source=self._source)
+        else:
+            for update in self.exportProgress(output, durationInMicroseconds):
+                progress(update)
+
+    def exportProgress(self, output, durationInMicroseconds=None):
+        with staged(output) as staging:
+            command = self.ffmpeg.export(staging, progress=True)
+            yield from parse_progress(self.runner.lines(command, source=self._source), durationInMicroseconds)
+
+    async def exportAsync(self, output, semaphore=None):
+        await self.firstpassAsync(semaphore=semaphore)
+        with staged(output) as staging:
+            await self.runner.runAsync(self.ffmpeg.export(staging), source=self._source, semaphore=semaphore)
+
+    def exportStream(self, format='mp4', chunk_size=64 * 1024):
+        return self.runner.chunks(self.ffmpeg.exportStream(format), source=self._source, chunk_size=chunk_size)
+
+    def exportStreamAsync(self, format='mp4', chunk_size=64 * 1024):
+        return self.runner.chunksAsync(self.ffmpeg.exportStream(format), source=self._source, chunk_size=chunk_size)
+
+    def exportSplit(self, renditions):
+        self.requirePath('exportSplit')
+        with tempfile.TemporaryDirectory() as links, ExitStack() as outputs:
+            builders = []
+            for position, (adapter, output) in enumerate(renditions):
+                adapter.firstpass()
+                ffmpeg = adapter.ffmpeg
+                if ffmpeg.twopass:
+                    # ffmpeg names pass logs after the global output stream index, which
+                    # shifts with the number of audio streams mapped by previous renditions
+                    prefix = os.path.join(links, str(position))
+                    for index in range(position, 2 * position + 1):
+                        for ext in ('.log', '.log.mbtree'):
+                            if os.path.exists(f'{ffmpeg.passlogfile}-0{ext}'):
+                                os.symlink(f'{ffmpeg.passlogfile}-0{ext}', f'{prefix}-{index}{ext}')
+                    ffmpeg.passlogfile = prefix
+                builders.append((ffmpeg, outputs.enter_context(staged(output))))
+            self.runner.run(self.ffmpeg.exportSplit(builders))
+
+    def slice(self, output, startInMillisecond, durationInMicroseconds, progress=None, seekInMilliseconds=None):
+        self.requirePath('slice')
+        # input seeking lands on the keyframe, output seeking then trims up to the exact start
+        seek = None if seekInMilliseconds is None else str(round(seekInMilliseconds / 1000, 6))
+        start_str = str(round((startInMillisecond - (seekInMilliseconds or 0)) / 1000, 6))
         duration_str = str(round(durationInMicroseconds / 1000, 3))
-        process(self.ffmpeg.slice(output, start_str, duration_str))
+        ffmpeg = self.builder(passlogfile=None)
+        if progress is None:
+            self.runner.run(ffmpeg.slice(output, start_str, duration_str, seek=seek))
+        else:
+            command = ffmpeg.slice(output, start_str, duration_str, progress=True, seek=seek)
+            for update in parse_progress(self.runner.lines(command), durationInMicroseconds * 1000):
+                progress(update)
+
+    def trial(self, startInMilliseconds, durationInMilliseconds, crf=None, preset=None, **overrides):
+        self.requirePath('trial')
+        ffmpeg = self.builder(passlogfile=None, **overrides)
+        command = ffmpeg.trial(
+            round(startInMilliseconds / 1000, 3), round(durationInMilliseconds / 1000, 3), crf=crf, preset=preset
+        )
+        started = time.monotonic()
+        size = sum(len(chunk) for chunk in self.runner.chunks(command))
+        return size, time.monotonic() - started
+
+    def thumbnails(self, pattern, sprite, size, layout, timesInMilliseconds=None, intervalInMilliseconds=None, exact=True):
+        self.requirePath('thumbnails')
+        if timesInMilliseconds is not None:
+            select = select_times([round(t / 1000, 3) for t in timesInMilliseconds])
+        else:
+            select = select_interval(round(intervalInMilliseconds / 1000, 3))
+        times = []
+        command = self.ffmpeg.thumbnails(pattern, sprite, select, size, layout, exact=exact)
+        self.runner.run(command, on_log=lambda line: times.extend(parse_showinfo(line)))
+        return [round(t * 1000) for t in times]
+
+    def frames(self, buffers, pix_fmt='rgb24', stride=1):
+        self.requirePath('frames')
+        return self.runner.readinto(self.builder(passlogfile=None).rawvideo(pix_fmt, stride), buffers)
+
+    def reference(self, output, startInMilliseconds, durationInMilliseconds):
+        self.requirePath('reference')
+        ffmpeg = self.builder(scale=None, passlogfile=None)
+        self.runner.run(ffmpeg.reference(output, round(startInMilliseconds / 1000, 3), round(durationInMilliseconds / 1000, 3)))
+
+    def exportSample(self, reference, output):
+        ffmpeg = self.builder(input=reference, crop_origin=None, crop_size=None, fps=None, mute=True, passlogfile=None)
+        self.runner.run(ffmpeg.sample(output))
+
+    def compare(self, distorted, reference):
+        result = self.runner.run(self.builder(input=distorted, passlogfile=None).compare(reference), check=False)
+        return parse_quality(result.log)
+
+    def segment(self, output_pattern, timesInMilliseconds, copy=True, streams=('-map', '0:v:0')):
+        self.requirePath('segment')
+        directory = os.path.dirname(output_pattern)
+        times = [round(t / 1000, 3) for t in timesInMilliseconds]
+        fd, segment_list = tempfile.mkstemp(suffix='.csv')
+        os.close(fd)
+
+        try:
+            self.runner.run(self.builder(passlogfile=None).segment(output_pattern, times, segment_list, copy=copy, streams=streams))
+            segments = []
+            with open(segment_list) as f:
+                for line in f:
+                    filename, start, end = line.strip().rsplit(',', 2)
+                    segments.append((os.path.join(directory, filename), float(start), float(end)))
+        finally:
+            os.remove(segment_list)
+
+        return segments
+
+    def concat(self, inputs, output):
+        self.requirePath('concat')
+        listfile = f'{output}.concat.txt'
+        with open(listfile, 'w') as f:
+            for input in inputs:
+                escaped = os.path.abspath(input).replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        try:
+            with staged(output) as staging:
+                self.runner.run(self.ffmpeg.concat(listfile, staging))
+        finally:
+            os.remove(listfile)
+
+    def fragment(self, output, progress=None, durationInMicroseconds=None):
+        with staged(output) as staging:
+            if progress is None:
+                self.runner.run(self.ffmpeg.fragment(staging), source=self._source)
+                return
+            command = self.ffmpeg.fragment(staging, progress=True)
+            for update in parse_progress(self.runner.lines(command, source=self._source), durationInMicroseconds):
+                progress(update)
 
-    def fragment(self, output):
-        check_bin(self._bin_mp4fragment)
-        process(f'{self._bin_mp4fragment} {self._input} {output}')
\ No newline at end of file
+    def package(self, renditions, directory, format='hls', segmentInMilliseconds=4000, audio=True):
+        self.requirePath('package')
+        os.makedirs(directory, exist_ok=True)
+        builders = [adapter.builder(passlogfile=None) for adapter in renditions]
+        segment = round(segmentInMilliseconds / 1000, 3)
+        if format == 'hls':
+            self.runner.run(self.ffmpeg.hls(builders, directory, segment, audio=audio))
+            return os.path.join(directory, 'master.m3u8')
+        if format == 'dash':
+            self.runner.run(self.ffmpeg.dash(builders, directory, segment, audio=audio))
+            return os.path.join(directory, 'manifest.mpd')
+        raise ValueError(f'Unknown packaging format {format!r}, expected hls or dash')
\ No newline at end of file
@@ -0,0 +1,302 @@
+import os
+import mmap
+import struct
+from fractions import Fraction
+
+from ..exceptions import InvalidVideoInput
+
+
+CONTAINER_BOXES = {b'moov', b'trak', b'mdia', b'minf', b'stbl', b'mvex', b'moof', b'traf', b'edts'}
+
+
+def iterBoxes(buffer, start, end):
+    offset = start
+    while offset + 8 <= end:
+        size, type = struct.unpack_from('>I4s', buffer, offset)
+        header = 8
+        if size == 1:
+            size, = struct.unpack_from('>Q', buffer, offset + 8)
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header or offset + size > end:
+            raise InvalidVideoInput(f'Truncated {type!r} box at offset {offset}')
+        yield type, offset + header, offset + size
+        offset += size
+
+
+def readFullBox(buffer, start):
+    version = buffer[start]
+    flags = int.from_bytes(buffer[start + 1:start + 4], 'big')
+    return version, flags, start + 4
+
+
+class mp4Track():
+
+    def __init__(self):
+        self.id = None
+        self.handler = None
+        self.codec = None
+        self.width = 0
+        self.height = 0
+        self.timescale = 0
+        self.duration = 0
+        self.sample_count = 0
+        self.sample_bytes = 0
+        self.default_sample_duration = 0
+        self.default_sample_size = 0
+
+    @property
+    def seconds(self):
+        return self.duration / self.timescale if self.timescale else 0
+
+    @property
+    def bitrate(self):
+        return round(self.sample_bytes * 8 / self.seconds) if self.seconds else 0
+
+
+class mp4Movie():
+
+    def __init__(self):
+        self.timescale = 0
+        self.duration = 0
+        self.fragmented = False
+        self.fragments = 0
+        self.tracks = []
+
+    @property
+    def seconds(self):
+        return self.duration / self.timescale if self.timescale else 0
+
+    def track(self, handler):
+        return next((t for t in self.tracks if t.handler == handler), None)
+
+    @property
+    def videoTrack(self):
+        return self.track(b'vide')
+
+    @property
+    def audioTrack(self):
+        return self.track(b'soun')
+
+
+class mp4BoxParser():
+
+    def __init__(self, input):
+        self.input = input
+
+    def parse(self):
+        try:
+            with open(self.input, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                return self.parseBuffer(buffer)
+        except (OSError, ValueError, struct.error) as error:
+            raise InvalidVideoInput(str(error))
+
+    def parseBuffer(self, buffer):
+        movie = mp4Movie()
+        has_moov = False
+
+        for type, start, end in iterBoxes(buffer, 0, len(buffer)):
+            if type == b'moov':
+                has_moov = True
+                self.parseMoov(buffer, start, end, movie)
+            elif type == b'moof':
+                movie.fragmented = True
+                movie.fragments += 1
+                self.parseMoof(buffer, start, end, movie)
+
+        if not has_moov:
+            raise InvalidVideoInput(f'No moov box in {self.input}')
+
+        return movie
+
+    def parseMoov(self, buffer, start, end, movie):
+        mvex = None
+        for type, box_start, box_end in iterBoxes(buffer, start, end):
+            if type == b'mvhd':
+                version, flags, offset = readFullBox(buffer, box_start)
+                if version == 1:
+                    movie.timescale, movie.duration = struct.unpack_from('>IQ', buffer, offset + 16)
+                else:
+                    movie.timescale, movie.duration = struct.unpack_from('>II', buffer, offset + 8)
+            elif type == b'trak':
+                track = mp4Track()
+                self.parseTrak(buffer, box_start, box_end, track)
+                movie.tracks.append(track)
+            elif type == b'mvex':
+                movie.fragmented = True
+                mvex = (box_start, box_end)
+
+        if mvex:
+            self.parseMvex(buffer, *mvex, movie)
+
+    def parseTrak(self, buffer, start, end, track):
+        for type, box_start, box_end in iterBoxes(buffer, start, end):
+            if type in CONTAINER_BOXES:
+                self.parseTrak(buffer, box_start, box_end, track)
+            elif type == b'tkhd':
+                version, flags, offset = readFullBox(buffer, box_start)
+                track.id, = struct.unpack_from('>I', buffer, offset + (16 if version == 1 else 8))
+                width, height = struct.unpack_from('>II', buffer, box_end - 8)
+                track.width = track.width or width >> 16
+                track.height = track.height or height >> 16
+            elif type == b'mdhd':
+                version, flags, offset = readFullBox(buffer, box_start)
+                if version == 1:
+                    track.timescale, track.duration = struct.unpack_from('>IQ', buffer, offset + 16)
+                else:
+                    track.timescale, track.duration = struct.unpack_from('>II', buffer, offset + 8)
+            elif type == b'hdlr':
+                track.handler = bytes(buffer[box_start + 8:box_start + 12])
+            elif type == b'stsd':
+                self.parseStsd(buffer, box_start, box_end, track)
+            elif type == b'stsz':
+                version, flags, offset = readFullBox(buffer, box_start)
+                sample_size, sample_count = struct.unpack_from('>II', buffer, offset)
+                track.sample_count += sample_count
+                if sample_size:
+                    track.sample_bytes += sample_size * sample_count
+                else:
+                    track.sample_bytes += sum(struct.unpack_from(f'>{sample_count}I', buffer, offset + 8))
+
+    def parseStsd(self, buffer, start, end, track):
+        version, flags, offset = readFullBox(buffer, start)
+        for type, entry_start, entry_end in iterBoxes(buffer, offset + 4, end):
+            track.codec = type.decode('latin-1')
+            if track.handler == b'vide' and entry_end - entry_start >= 28:
+                track.width, track.height = struct.unpack_from('>HH', buffer, entry_start + 24)
+            break
+
+    def parseMvex(self, buffer, start, end, movie):
+        for type, box_start, box_end in iterBoxes(buffer, start, end):
+            if type == b'mehd':
+                version, flags, offset = readFullBox(buffer, box_start)
+                fragment_duration, = struct.unpack_from('>Q' if version == 1 else '>I', buffer, offset)
+                movie.duration = max(movie.duration, fragment_duration)
+            elif type == b'trex':
+                version, flags, offset = readFullBox(buffer, box_start)
+                track_id, description, duration, size = struct.unpack_from('>IIII', buffer, offset)
+                for track in movie.tracks:
+                    if track.id == track_id:
+                        track.default_sample_duration = duration
+                        track.default_sample_size = size
+
+    def parseMoof(self, buffer, start, end, movie):
+        for type, box_start, box_end in iterBoxes(buffer, start, end):
+            if type == b'traf':
+                self.parseTraf(buffer, box_start, box_end, movie)
+
+    def parseTraf(self, buffer, start, end, movie):
+        track = None
+        default_duration = default_size = 0
+
+        for type, box_start, box_end in iterBoxes(buffer, start, end):
+            if type == b'tfhd':
+                version, flags, offset = readFullBox(buffer, box_start)
+                track_id, = struct.unpack_from('>I', buffer, offset)
+                track = next((t for t in movie.tracks if t.id == track_id), None)
+                if track is None:
+                    return
+                default_duration = track.default_sample_duration
+                default_size = track.default_sample_size
+                offset += 4
+                if flags & 0x01:
+                    offset += 8
+                if flags & 0x02:
+                    offset += 4
+                if flags & 0x08:
+                    default_duration, = struct.unpack_from('>I', buffer, offset)
+                    offset += 4
+                if flags & 0x10:
+                    default_size, = struct.unpack_from('>I', buffer, offset)
+            elif type == b'trun' and track is not None:
+                version, flags, offset = readFullBox(buffer, box_start)
+                sample_count, = struct.unpack_from('>I', buffer, offset)
+                offset += 4
+                if flags & 0x01:
+                    offset += 4
+                if flags & 0x04:
+                    offset += 4
+
+                fields = [mask for mask in (0x100, 0x200, 0x400, 0x800) if flags & mask]
+                values = struct.unpack_from(f'>{sample_count * len(fields)}I', buffer, offset)
+                columns = {mask: values[i::len(fields)] for i, mask in enumerate(fields)}
+
+                track.sample_count += sample_count
+                track.duration += sum(columns[0x100]) if 0x100 in columns else default_duration * sample_count
+                track.sample_bytes += sum(columns[0x200]) if 0x200 in columns else default_size * sample_count
+
+
+class mp4BoxVideoInfoAdapter():
+
+    def __init__(self, input=None, **kwargs):
+        self.input = input
+        self._movie = None
+
+    @property
+    def movie(self):
+        if self._movie is None:
+            self._movie = mp4BoxParser(self.input).parse()
+        return self._movie
+
+    def probe(self):
+        return self.movie
+
+    async def probeAsync(self, semaphore=None):
+        return self.movie
+
+    def check_video_integrity(self, input, level=None):
+        if level != 'none':
+            self.movie
+
+    async def check_video_integrity_async(self, input, level=None, semaphore=None):
+        self.check_video_integrity(input, level=level)
+
+    def volumedetect(self):
+        return self.hasAudioStream()
+
+    def hasAudioStream(self):
+        return self.movie.audioTrack is not None
+
+    def track(self, handler):
+        track = self.movie.track(handler)
+        if track is None:
+            raise InvalidVideoInput(f'No {handler.decode()} track in {self.input}')
+        return track
+
+    def getResolution(self):
+        video = self.track(b'vide')
+        return (video.width, video.height)
+
+    def getVideoBitrate(self):
+        video = self.movie.videoTrack
+        return video.bitrate if video else 0
+
+    def getAudioBitrate(self):
+        audio = self.movie.audioTrack
+        return audio.bitrate if audio else 0
+
+    def getDurationInMicroseconds(self):
+        video = self.movie.videoTrack
+        seconds = video.seconds if video and video.seconds else self.movie.seconds
+        return round(seconds * 1000 * 1000)
+
+    def getSize(self):
+        return os.path.getsize(self.input)
+
+    def getFramePerSeconds(self):
+        video = self.track(b'vide')
+        return round(video.sample_count / video.seconds) if video.seconds else 0
+
+    def getFrameRate(self):
+        video = self.track(b'vide')
+        return Fraction(video.sample_count * video.timescale, video.duration) if video.duration else Fraction(0)
+
+    def getTimescale(self):
+        return self.track(b'vide').timescale
+
+    def getSampleCount(self):
+        return self.track(b'vide').sample_count
+
+    def isFragmented(self):
+        return self.movie.fragmented
@@ -0,0 +1,486 @@
+import os
+import re
+import sys
+import time
+import shlex
+import signal
+import asyncio
+import threading
+import subprocess
+from itertools import count
+from collections import deque
+
+from ..exceptions import ProcessError, ProcessTimeoutError
+
+
+RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+NEWLINES = re.compile(rb'\r\n|\r|\n')
+
+
+def split(command):
+    if isinstance(command, (list, tuple)):
+        return [os.fspath(arg) if isinstance(arg, os.PathLike) else str(arg) for arg in command]
+    return shlex.split(command)
+
+
+def feed(source, stdin, errors, chunk_size=64 * 1024):
+    chunks = iter(lambda: source.read(chunk_size), b'') if hasattr(source, 'read') else source
+    try:
+        for chunk in chunks:
+            stdin.write(chunk)
+    except (BrokenPipeError, ValueError):
+        pass
+    except Exception as error:
+        errors.append(error)
+    finally:
+        try:
+            stdin.close()
+        except BrokenPipeError:
+            pass
+
+
+async def feed_async(source, stdin, chunk_size=64 * 1024):
+    try:
+        if hasattr(source, '__aiter__'):
+            async for chunk in source:
+                stdin.write(chunk)
+                await stdin.drain()
+        else:
+            chunks = iter(lambda: source.read(chunk_size), b'') if hasattr(source, 'read') else source
+            for chunk in chunks:
+                stdin.write(chunk)
+                await stdin.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+    finally:
+        stdin.close()
+
+
+def open_pidfd(pid):
+    try:
+        return os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        return None
+
+
+async def read_pipe(pipe):
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    transport, protocol = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+    return reader, transport
+
+
+async def write_pipe(pipe):
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, pipe)
+    return asyncio.StreamWriter(transport, protocol, None, loop)
+
+
+class logTail():
+
+    def __init__(self, lines=200, line_length=4096, on_line=None):
+        self.lines = deque(maxlen=lines)
+        self.line_length = line_length
+        self.on_line = on_line
+        self.errors = []
+        self._pending = b''
+
+    def feed(self, chunk):
+        *lines, self._pending = NEWLINES.split(self._pending + chunk)
+        self._pending = self._pending[:self.line_length]
+        for line in lines:
+            self.append(line)
+
+    def append(self, line):
+        if not line:
+            return
+        line = line[:self.line_length].decode('utf-8', errors='replace')
+        self.lines.append(line)
+        if self.on_line is not None and not self.errors:
+            try:
+                self.on_line(line)
+            except Exception as error:
+                self.errors.append(error)
+
+    def close(self):
+        self.append(self._pending)
+        self._pending = b''
+
+    def __str__(self):
+        return '\n'.join(self.lines)
+
+
+class ProcessResult():
+
+    def __init__(self, argv, returncode, stdout=b'', log='', elapsed=0.0, rusage=None, timed_out=False):
+        self.argv = argv
+        self.returncode = returncode
+        self.stdout = stdout
+        self.log = log
+        self.elapsed = elapsed
+        self.cpu_time = rusage.ru_utime + rusage.ru_stime if rusage else None
+        self.max_rss = rusage.ru_maxrss * RSS_UNIT if rusage else None
+        self.timed_out = timed_out
+
+    @property
+    def text(self):
+        return self.stdout.decode('utf-8', errors='replace')
+
+
+def checkResult(process, result, check=True):
+    if process.cancelled:
+        return result
+    if process.errors or process.log.errors:
+        raise (process.errors + process.log.errors)[0]
+    if result.timed_out:
+        raise ProcessTimeoutError(result)
+    if check and result.returncode != 0:
+        raise ProcessError(result)
+    return result
+
+
+class childProcess():
+
+    def __init__(self, runner, command, source=None, timeout=None, on_log=None, buffered=True):
+        self.runner = runner
+        self.argv = split(command)
+        self.log = logTail(runner.log_lines, runner.line_length, on_line=on_log)
+        self.errors = []
+        self.result = None
+        self.cancelled = False
+        self.timed_out = False
+        self.started = time.monotonic()
+        self._reaped = False
+        self._lock = threading.Lock()
+
+        self.child = subprocess.Popen(
+            self.argv,
+            stdin=subprocess.DEVNULL if source is None else subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=-1 if buffered else 0,
+        )
+        self.drain = threading.Thread(target=self.drainLog, daemon=True)
+        self.drain.start()
+        if source is not None:
+            threading.Thread(
+                target=feed, args=(source, self.child.stdin, self.errors, runner.chunk_size), daemon=True
+            ).start()
+
+        timeout = runner.timeout if timeout is None else timeout
+        self.timer = threading.Timer(timeout, self.expire) if timeout else None
+        if self.timer is not None:
+            self.timer.daemon = True
+            self.timer.start()
+
+    @property
+    def stdout(self):
+        return self.child.stdout
+
+    def drainLog(self):
+        fd = self.child.stderr.fileno()
+        for chunk in iter(lambda: os.read(fd, 64 * 1024), b''):
+            self.log.feed(chunk)
+        self.log.close()
+
+    def kill(self):
+        with self._lock:
+            if not self._reaped:
+                try:
+                    os.kill(self.child.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+    def expire(self):
+        self.timed_out = True
+        self.kill()
+
+    def cancel(self):
+        self.cancelled = True
+        self.kill()
+
+    def reap(self):
+        # waits for the exit without reaping first, so kill() never signals a recycled pid,
+        # then reaps with wait4 to get the resource usage of this child only
+        if hasattr(os, 'waitid'):
+            os.waitid(os.P_PID, self.child.pid, os.WEXITED | os.WNOWAIT)
+        with self._lock:
+            pid, status, rusage = os.wait4(self.child.pid, 0)
+            self._reaped = True
+        self.child.returncode = os.waitstatus_to_exitcode(status)
+        return rusage
+
+    def finish(self, stdout=b''):
+        if self.result is not None:
+            return self.result
+        rusage = self.reap()
+        if self.timer is not None:
+            self.timer.cancel()
+        self.drain.join()
+        for pipe in (self.child.stdout, self.child.stderr):
+            pipe.close()
+        self.result = ProcessResult(
+            self.argv,
+            self.child.returncode,
+            stdout=stdout,
+            log=str(self.log),
+            elapsed=time.monotonic() - self.started,
+            rusage=rusage,
+            timed_out=self.timed_out,
+        )
+        self.runner.record(self.result)
+        return self.result
+
+    def wait(self, check=True, stdout=b''):
+        return checkResult(self, self.finish(stdout=stdout), check)
+
+    def communicate(self, check=True):
+        return self.wait(check=check, stdout=self.child.stdout.read())
+
+    def close(self):
+        if self.result is None:
+            self.cancel()
+            self.finish()
+
+
+class asyncChildProcess():
+
+    def __init__(self, runner, command, timeout=None, on_log=None):
+        self.runner = runner
+        self.argv = split(command)
+        self.log = logTail(runner.log_lines, runner.line_length, on_line=on_log)
+        self.timeout = runner.timeout if timeout is None else timeout
+        self.errors = []
+        self.result = None
+        self.cancelled = False
+        self.timed_out = False
+        self.feeder = None
+        self.timer = None
+        self.pidfd = None
+        self._reaped = False
+
+    async def start(self, source=None, chunk_size=64 * 1024):
+        self.started = time.monotonic()
+        self.child = subprocess.Popen(
+            self.argv,
+            stdin=subprocess.DEVNULL if source is None else subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=0,
+        )
+        self.pidfd = open_pidfd(self.child.pid)
+        self.reaper = asyncio.ensure_future(self.reap())
+        self.stdout, stdout = await read_pipe(self.child.stdout)
+        self.stderr, stderr = await read_pipe(self.child.stderr)
+        self.transports = [stdout, stderr]
+        self.drain = asyncio.ensure_future(self.drainLog())
+        if source is not None:
+            stdin = await write_pipe(self.child.stdin)
+            self.transports.append(stdin.transport)
+            self.feeder = asyncio.ensure_future(feed_async(source, stdin, chunk_size))
+        if self.timeout:
+            self.timer = asyncio.get_running_loop().call_later(self.timeout, self.expire)
+        return self
+
+    async def drainLog(self):
+        while True:
+            chunk = await self.stderr.read(64 * 1024)
+            if not chunk:
+                break
+            self.log.feed(chunk)
+        self.log.close()
+
+    def kill(self):
+        # the child is reaped on the event loop thread, so it is never signalled once its pid is recycled
+        if self._reaped:
+            return
+        try:
+            if self.pidfd is not None:
+                signal.pidfd_send_signal(self.pidfd, signal.SIGKILL)
+            else:
+                os.kill(self.child.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def expire(self):
+        self.timed_out = True
+        self.kill()
+
+    def cancel(self):
+        self.cancelled = True
+        self.kill()
+
+    async def reap(self):
+        # waits for the exit without reaping first, then reaps with wait4 to get the resource usage
+        loop = asyncio.get_running_loop()
+        if self.pidfd is not None:
+            exited = loop.create_future()
+            loop.add_reader(self.pidfd, lambda: exited.done() or exited.set_result(None))
+            try:
+                await exited
+            finally:
+                loop.remove_reader(self.pidfd)
+        else:
+            await loop.run_in_executor(None, os.waitid, os.P_PID, self.child.pid, os.WEXITED | os.WNOWAIT)
+        pid, status, rusage = os.wait4(self.child.pid, 0)
+        self._reaped = True
+        if self.pidfd is not None:
+            os.close(self.pidfd)
+            self.pidfd = None
+        self.child.returncode = os.waitstatus_to_exitcode(status)
+        return rusage
+
+    async def finish(self, stdout=b''):
+        if self.result is not None:
+            return self.result
+        if self.timer is not None:
+            self.timer.cancel()
+        if self.feeder is not None and not self.feeder.done():
+            self.feeder.cancel()
+        rusage = await asyncio.shield(self.reaper)
+        await self.drain
+        for transport in self.transports:
+            transport.close()
+        self.result = ProcessResult(
+            self.argv,
+            self.child.returncode,
+            stdout=stdout,
+            log=str(self.log),
+            elapsed=time.monotonic() - self.started,
+            rusage=rusage,
+            timed_out=self.timed_out,
+        )
+        self.runner.record(self.result)
+        return self.result
+
+    async def wait(self, check=True, stdout=b''):
+        if self.feeder is not None:
+            await self.feeder
+        return checkResult(self, await self.finish(stdout=stdout), check)
+
+    async def communicate(self, check=True):
+        return await self.wait(check=check, stdout=await self.stdout.read())
+
+    async def close(self):
+        if self.result is None:
+            self.cancel()
+            await self.finish()
+
+
+class ProcessRunner():
+
+    def __init__(self, timeout=None, log_lines=200, line_length=4096, chunk_size=64 * 1024, on_exit=None):
+        self.timeout = timeout
+        self.log_lines = log_lines
+        self.line_length = line_length
+        self.chunk_size = chunk_size
+        self.on_exit = on_exit
+        self.processes = 0
+        self.failures = 0
+        self.cpu_time = 0.0
+        self.max_rss = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def record(self, result):
+        with self._lock:
+            self.processes += 1
+            self.failures += result.returncode != 0
+            self.cpu_time += result.cpu_time or 0
+            self.max_rss = max(self.max_rss, result.max_rss or 0)
+        if self.on_exit is not None:
+            self.on_exit(result)
+
+    def stats(self):
+        return {
+            'processes': self.processes,
+            'failures': self.failures,
+            'cpu_time': self.cpu_time,
+            'max_rss': self.max_rss,
+        }
+
+    def open(self, command, source=None, timeout=None, on_log=None, buffered=True):
+        return childProcess(self, command, source=source, timeout=timeout, on_log=on_log, buffered=buffered)
+
+    async def openAsync(self, command, source=None, chunk_size=None, timeout=None, on_log=None):
+        process = asyncChildProcess(self, command, timeout=timeout, on_log=on_log)
+        return await process.start(source=source, chunk_size=chunk_size or self.chunk_size)
+
+    def run(self, command, source=None, check=True, timeout=None, on_log=None):
+        process = self.open(command, source=source, timeout=timeout, on_log=on_log)
+        try:
+            return process.communicate(check=check)
+        finally:
+            process.close()
+
+    async def runAsync(self, command, source=None, check=True, timeout=None, on_log=None, semaphore=None):
+        if semaphore is not None:
+            async with semaphore:
+                return await self.runAsync(command, source=source, check=check, timeout=timeout, on_log=on_log)
+
+        process = await self.openAsync(command, source=source, timeout=timeout, on_log=on_log)
+        try:
+            return await process.communicate(check=check)
+        finally:
+            await process.close()
+
+    def lines(self, command, source=None, check=True, timeout=None, on_log=None):
+        process = self.open(command, source=source, timeout=timeout, on_log=on_log)
+        try:
+            for line in iter(process.stdout.readline, b''):
+                yield line.decode('utf-8', errors='replace')
+            process.wait(check=check)
+        finally:
+            process.close()
+
+    def chunks(self, command, source=None, chunk_size=None, check=True, timeout=None):
+        chunk_size = chunk_size or self.chunk_size
+        process = self.open(command, source=source, timeout=timeout)
+        try:
+            for chunk in iter(lambda: process.stdout.read1(chunk_size), b''):
+                yield chunk
+            process.wait(check=check)
+        finally:
+            process.close()
+
+    def readinto(self, command, buffers, check=True, timeout=None):
+        buffers = list(buffers)
+        views = [memoryview(buffer).cast('B') for buffer in buffers]
+        process = self.open(command, timeout=timeout, buffered=False)
+        try:
+            for i in count():
+                view = views[i % len(views)]
+                filled = 0
+                while filled < len(view):
+                    read = process.stdout.readinto(view[filled:])
+                    if not read:
+                        break
+                    filled += read
+                if filled < len(view):
+                    break
+                yield buffers[i % len(buffers)]
+            process.wait(check=check)
+        finally:
+            process.close()
+
+    async def chunksAsync(self, command, source=None, chunk_size=None, check=True, timeout=None):
+        chunk_size = chunk_size or self.chunk_size
+        process = await self.openAsync(command, source=source, chunk_size=chunk_size, timeout=timeout)
+        try:
+            while True:
+                chunk = await process.stdout.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+            await process.wait(check=check)
+        finally:
+            await process.close()
@@ -0,0 +1,115 @@
+from .exceptions import MissingLibraryError
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def require_numpy(feature='audio analysis', extra='audio'):
+    if np is None:
+        raise MissingLibraryError(f'numpy is required for {feature}: pip install video-compressor[{extra}]')
+    return np
+
+
+def decibels(values):
+    return 20 * np.log10(np.maximum(values, 1e-10))
+
+
+class AudioAnalysis():
+
+    def __init__(self, window_ms, rms, peak, silence_threshold=-50, silence_duration_ms=500, waveform_points=1000):
+        self.window_ms = window_ms
+        self.rms = rms
+        self.peak = peak
+        self.silence_threshold = silence_threshold
+        self.silence_duration_ms = silence_duration_ms
+        self.waveform_points = waveform_points
+
+    @property
+    def rmsInDecibels(self):
+        return decibels(self.rms)
+
+    @property
+    def peakInDecibels(self):
+        return decibels(self.peak)
+
+    @property
+    def silences(self):
+        silent = np.concatenate(([False], self.rmsInDecibels < self.silence_threshold, [False]))
+        edges = np.flatnonzero(np.diff(silent.astype(np.int8)))
+        ranges = []
+        for start, stop in zip(edges[::2], edges[1::2]):
+            if (stop - start) * self.window_ms >= self.silence_duration_ms:
+                ranges.append((int(start) * self.window_ms, int(stop) * self.window_ms))
+        return ranges
+
+    def isSilent(self):
+        return len(self.peak) == 0 or bool(np.all(self.peakInDecibels < self.silence_threshold))
+
+    @property
+    def waveform(self):
+        if len(self.peak) <= self.waveform_points:
+            return self.peak.copy()
+        buckets = np.array_split(self.peak, self.waveform_points)
+        return np.array([bucket.max() for bucket in buckets], dtype=np.float32)
+
+
+class AudioAnalyzer():
+
+    def __init__(
+        self,
+        sample_rate=16000,
+        window_ms=50,
+        silence_threshold=-50,
+        silence_duration_ms=500,
+        waveform_points=1000,
+    ):
+        require_numpy()
+        self.sample_rate = sample_rate
+        self.window_ms = window_ms
+        self.window = max(1, sample_rate * window_ms // 1000)
+        self.silence_threshold = silence_threshold
+        self.silence_duration_ms = silence_duration_ms
+        self.waveform_points = waveform_points
+        self._pending = b''
+        self._rms = []
+        self._peak = []
+
+    def feed(self, chunk):
+        data = self._pending + chunk
+        usable = len(data) - len(data) % (self.window * 2)
+        self._pending = data[usable:]
+        if usable == 0:
+            return
+
+        samples = np.frombuffer(data[:usable], dtype='<i2').astype(np.float32) / 32768
+        windows = samples.reshape(-1, self.window)
+        self._rms.append(np.sqrt(np.mean(windows * windows, axis=1)))
+        self._peak.append(np.max(np.abs(windows), axis=1))
+
+    def analysis(self):
+        if len(self._pending) >= 2:
+            tail, self._pending = self._pending[:len(self._pending) - len(self._pending) % 2], b''
+            samples = np.frombuffer(tail, dtype='<i2').astype(np.float32) / 32768
+            self._rms.append(np.array([np.sqrt(np.mean(samples * samples))], dtype=np.float32))
+            self._peak.append(np.array([np.max(np.abs(samples))], dtype=np.float32))
+
+        rms = np.concatenate(self._rms) if self._rms else np.zeros(0, dtype=np.float32)
+        peak = np.concatenate(self._peak) if self._peak else np.zeros(0, dtype=np.float32)
+        self._rms = [rms]
+        self._peak = [peak]
+
+        return AudioAnalysis(
+            self.window_ms,
+            rms,
+            peak,
+            silence_threshold=self.silence_threshold,
+            silence_duration_ms=self.silence_duration_ms,
+            waveform_points=self.waveform_points,
+        )
+
+    def analyze(self, chunks):
+        for chunk in chunks:
+            self.feed(chunk)
+        return self.analysis()
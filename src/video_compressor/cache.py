@@ -0,0 +1,254 @@
+import os
+import re
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from functools import lru_cache
+
+
+@lru_cache(maxsize=1024)
+def content_digest(path, size, mtime, chunk_size=1024 * 1024):
+    # keyed by size and mtime so a file is hashed once per version, not on every lookup
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def fingerprint(path, content_hash=False, chunk_size=1024 * 1024):
+    stat = os.stat(path)
+    path = os.path.abspath(path)
+    digest = content_digest(path, stat.st_size, stat.st_mtime_ns, chunk_size) if content_hash else ''
+    return (path, stat.st_size, stat.st_mtime_ns, digest)
+
+
+class ProbeCache():
+
+    def __init__(self, path, max_entries=10000, content_hash=False):
+        self.path = path
+        self.max_entries = max_entries
+        self.content_hash = content_hash
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_local']
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS probes ('
+                'path TEXT, namespace TEXT, size INTEGER, mtime INTEGER, digest TEXT, '
+                'payload TEXT, accessed REAL, PRIMARY KEY (path, namespace))'
+            )
+            self._local.connection = connection
+        return connection
+
+    @property
+    def directory(self):
+        return os.path.dirname(os.path.abspath(self.path))
+
+    def key(self, input):
+        return fingerprint(input, content_hash=self.content_hash)
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, input, namespace='probe'):
+        try:
+            path, size, mtime, digest = fingerprint(input)
+        except OSError:
+            self._count(False)
+            return None
+
+        row = self.connection.execute(
+            'SELECT payload, digest FROM probes WHERE path = ? AND namespace = ? AND size = ? AND mtime = ?',
+            (path, namespace, size, mtime)
+        ).fetchone()
+        # the content is only hashed to confirm a row that already matches the path, size and mtime
+        if row is not None and self.content_hash and row[1] != self.key(input)[3]:
+            row = None
+
+        if row is None:
+            self._count(False)
+            return None
+
+        self.connection.execute(
+            'UPDATE probes SET accessed = ? WHERE path = ? AND namespace = ?',
+            (time.time(), path, namespace)
+        )
+        self._count(True)
+        return json.loads(row[0])
+
+    def set(self, input, payload, namespace='probe'):
+        path, size, mtime, digest = self.key(input)
+        self.connection.execute(
+            'INSERT OR REPLACE INTO probes VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (path, namespace, size, mtime, digest, json.dumps(payload), time.time())
+        )
+        self.evict()
+
+    def evict(self):
+        self.connection.execute(
+            'DELETE FROM probes WHERE rowid IN '
+            '(SELECT rowid FROM probes ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,)
+        )
+
+    def clear(self):
+        self.connection.execute('DELETE FROM probes')
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM probes').fetchone()[0]
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self),
+        }
+
+
+def normalize_bitrate(bitrate):
+    match = re.fullmatch(r'\s*([0-9.]+)\s*([kKmMgG]?)\s*', str(bitrate))
+    if not match:
+        return bitrate
+    value, unit = match.groups()
+    return round(float(value) * {'': 1, 'k': 10 ** 3, 'm': 10 ** 6, 'g': 10 ** 9}[unit.lower()])
+
+
+def normalize_options(options):
+    normalized = {}
+    for key, value in options.items():
+        if key == 'input' or value is None or value is False:
+            continue
+        if isinstance(value, tuple):
+            value = list(value)
+        if key == 'bitrate':
+            value = normalize_bitrate(value)
+        normalized[key] = value
+    return normalized
+
+
+def place(source, destination):
+    if os.path.lexists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+class ExportCache():
+
+    def __init__(self, directory, max_bytes=10 * 1024 ** 3, content_hash=False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.content_hash = content_hash
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def key(self, input, options, adapter_version, output):
+        path, size, mtime, digest = fingerprint(input, content_hash=self.content_hash)
+        fingerprinted = digest or [path, size, mtime]
+        ext = os.path.splitext(output)[1].lower()
+        payload = json.dumps([fingerprinted, normalize_options(options), adapter_version, ext], sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest() + ext
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def fetch(self, key, output):
+        artifact = self.path(key)
+        try:
+            place(artifact, output)
+            os.utime(artifact)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return False
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def store(self, key, output):
+        if not os.path.exists(output):
+            return
+        fd, staging = tempfile.mkstemp(dir=self.directory, suffix='.partial')
+        os.close(fd)
+        try:
+            shutil.copyfile(output, staging)
+            os.replace(staging, self.path(key))
+        finally:
+            if os.path.exists(staging):
+                os.remove(staging)
+        self.evict()
+
+    def entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.partial'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        return entries
+
+    def evict(self):
+        entries = sorted(self.entries())
+        total = sum(size for mtime, size, name in entries)
+        while entries and total > self.max_bytes:
+            mtime, size, name = entries.pop(0)
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def stats(self):
+        entries = self.entries()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(entries),
+            'bytes': sum(size for mtime, size, name in entries),
+        }
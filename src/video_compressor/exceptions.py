@@ -8,3 +8,25 @@ class MissingLibraryError(VideoCompressorException):
 
 class InvalidVideoInput(VideoCompressorException):
     pass
+
+
+class TargetSizeError(VideoCompressorException):
+    pass
+
+
+class ProcessError(VideoCompressorException):
+
+    def __init__(self, result):
+        super().__init__(result)
+        self.result = result
+
+    def __str__(self):
+        lines = self.result.log.strip().splitlines()
+        reason = f': {lines[-1]}' if lines else ''
+        return f'{self.result.argv[0]} exited with status {self.result.returncode}{reason}'
+
+
+class ProcessTimeoutError(ProcessError):
+
+    def __str__(self):
+        return f'{self.result.argv[0]} killed after {self.result.elapsed:.1f}s'
@@ -0,0 +1,24 @@
+from .audio import require_numpy
+
+
+PIXEL_FORMATS = {'rgb24': 3, 'bgr24': 3, 'rgba': 4, 'bgra': 4, 'gray': 1}
+
+
+def frameSize(resolution, crop_size=None, scale=None):
+    width, height = crop_size or resolution
+    if not scale:
+        return (width, height)
+
+    w, h = scale
+    if w == -1:
+        w = int(h * width / height / 2) * 2
+    if h == -1:
+        h = int(w * height / width / 2) * 2
+    return (w, h)
+
+
+def frameRing(width, height, pix_fmt='rgb24', ring=4):
+    np = require_numpy('frame decoding', 'frames')
+    channels = PIXEL_FORMATS[pix_fmt]
+    shape = (ring, height, width) if channels == 1 else (ring, height, width, channels)
+    return np.empty(shape, dtype=np.uint8)
@@ -11,3 +11,25 @@ def rangeSliceBySteps(start, stop, step=1):
     if congruent_stop < stop:
         yield (congruent_stop, stop - congruent_stop)
 
+
+
+def sampleWindows(start, stop, count, window):
+
+    length = stop - start
+    if length <= window:
+        return [(start, length)] if length > 0 else []
+
+    section = length / count
+    starts = [start + round(section * i + (section - window) / 2) for i in range(count)]
+    starts = [min(max(s, start), stop - window) for s in starts]
+
+    return [(s, window) for s in sorted(set(starts))]
+
+
+def formatTimestamp(milliseconds):
+
+    seconds, milliseconds = divmod(round(milliseconds), 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+
+    return f'{hours:02d}:{minutes:02d}:{seconds:02d}.{milliseconds:03d}'
@@ -0,0 +1,95 @@
+import os
+import json
+import tempfile
+
+from .audio import require_numpy
+
+
+def parse_packet(line):
+    return dict(field.split('=', 1) for field in line.strip().split('|') if '=' in field)
+
+
+def number(value, default=None):
+    return default if value in (None, '', 'N/A') else value
+
+
+class PacketIndex():
+
+    def __init__(self, pts, pos, size, keyframe):
+        self.pts = pts
+        self.pos = pos
+        self.size = size
+        self.keyframe = keyframe
+
+    @classmethod
+    def fromLines(cls, lines):
+        np = require_numpy('packet indexing', 'index')
+        pts, pos, size, keyframe = [], [], [], []
+
+        for line in lines:
+            packet = parse_packet(line)
+            time = number(packet.get('pts_time')) or number(packet.get('dts_time'))
+            if time is None:
+                continue
+            pts.append(round(float(time) * 1000 * 1000))
+            pos.append(int(number(packet.get('pos'), -1)))
+            size.append(int(number(packet.get('size'), 0)))
+            keyframe.append('K' in packet.get('flags', ''))
+
+        pts = np.array(pts, dtype=np.int64)
+        order = np.argsort(pts, kind='stable')
+        return cls(
+            pts[order],
+            np.array(pos, dtype=np.int64)[order],
+            np.array(size, dtype=np.int32)[order],
+            np.array(keyframe, dtype=bool)[order],
+        )
+
+    @classmethod
+    def load(cls, path, key):
+        np = require_numpy('packet indexing', 'index')
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if json.loads(str(data['key'])) != key:
+                    return None
+                return cls(data['pts'], data['pos'], data['size'], data['keyframe'])
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def save(self, path, key):
+        np = require_numpy('packet indexing', 'index')
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, staging = tempfile.mkstemp(dir=directory, suffix='.partial')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(
+                    f, pts=self.pts, pos=self.pos, size=self.size, keyframe=self.keyframe, key=np.array(json.dumps(key))
+                )
+            os.replace(staging, path)
+        finally:
+            if os.path.exists(staging):
+                os.remove(staging)
+
+    def __len__(self):
+        return len(self.pts)
+
+    @property
+    def keyframes(self):
+        return self.pts[self.keyframe]
+
+    def keyframeBefore(self, timeInMicroseconds):
+        np = require_numpy('packet indexing', 'index')
+        keyframes = self.keyframes
+        i = int(np.searchsorted(keyframes, timeInMicroseconds, side='right')) - 1
+        return int(keyframes[i]) if i >= 0 else 0
+
+    def keyframeAfter(self, timeInMicroseconds):
+        np = require_numpy('packet indexing', 'index')
+        keyframes = self.keyframes
+        i = int(np.searchsorted(keyframes, timeInMicroseconds, side='left'))
+        return int(keyframes[i]) if i < len(keyframes) else None
+
+    def offsetBefore(self, timeInMicroseconds):
+        pos = self.pos[self.keyframe & (self.pts <= timeInMicroseconds)]
+        return int(pos[-1]) if len(pos) else 0
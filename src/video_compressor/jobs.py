@@ -0,0 +1,208 @@
+import json
+import time
+import sqlite3
+import threading
+
+from .video import VideoCompressor
+
+
+class Job():
+
+    def __init__(self, id, priority, status, payload, attempts, max_attempts, error=None):
+        self.id = id
+        self.priority = priority
+        self.status = status
+        self.payload = json.loads(payload)
+        self.attempts = attempts
+        self.max_attempts = max_attempts
+        self.error = error
+
+    @property
+    def options(self):
+        return self.payload['options']
+
+    @property
+    def output(self):
+        return self.payload['output']
+
+    @property
+    def settings(self):
+        return self.payload.get('settings')
+
+    def run(self, **adapter_options):
+        video = VideoCompressor(**self.options, **adapter_options)
+        if self.settings:
+            list(video.exportCollection(self.output, self.settings))
+        else:
+            video.export(self.output)
+
+
+class JobQueue():
+
+    COLUMNS = 'id, priority, status, payload, attempts, max_attempts, error'
+
+    def __init__(self, path, lease_seconds=6 * 3600, backoff_seconds=30, max_backoff_seconds=3600):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self._local = threading.local()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, priority INTEGER, status TEXT, payload TEXT, '
+                'attempts INTEGER DEFAULT 0, max_attempts INTEGER, available_at REAL, leased_until REAL, '
+                'worker TEXT, error TEXT, created_at REAL, updated_at REAL, key TEXT UNIQUE)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, priority, available_at)')
+            self._local.connection = connection
+        return connection
+
+    def put(self, options, output, settings=None, priority=0, max_attempts=3, delay=0, key=None):
+        now = time.time()
+        payload = json.dumps({'options': options, 'output': output, 'settings': settings})
+        cursor = self.connection.execute(
+            'INSERT OR IGNORE INTO jobs (priority, status, payload, max_attempts, available_at, created_at, updated_at, key) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (priority, 'queued', payload, max_attempts, now + delay, now, now, key)
+        )
+        if cursor.rowcount == 0:
+            return self.connection.execute('SELECT id FROM jobs WHERE key = ?', (key,)).fetchone()[0]
+        return cursor.lastrowid
+
+    def get(self, id):
+        row = self.connection.execute(f'SELECT {self.COLUMNS} FROM jobs WHERE id = ?', (id,)).fetchone()
+        return Job(*row) if row else None
+
+    def claim(self, worker='worker'):
+        now = time.time()
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute(
+                "UPDATE jobs SET status = 'failed', error = 'lease expired', updated_at = ? "
+                "WHERE status = 'running' AND leased_until < ? AND attempts >= max_attempts",
+                (now, now)
+            )
+            row = connection.execute(
+                f'SELECT {self.COLUMNS} FROM jobs '
+                "WHERE (status = 'queued' AND available_at <= ?) OR (status = 'running' AND leased_until < ?) "
+                'ORDER BY priority DESC, id LIMIT 1',
+                (now, now)
+            ).fetchone()
+            if row is None:
+                connection.execute('COMMIT')
+                return None
+            connection.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, leased_until = ?, worker = ?, "
+                'updated_at = ? WHERE id = ?',
+                (now + self.lease_seconds, worker, now, row[0])
+            )
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return self.get(row[0])
+
+    def heartbeat(self, job):
+        self.connection.execute(
+            "UPDATE jobs SET leased_until = ?, updated_at = ? WHERE id = ? AND attempts = ? AND status = 'running'",
+            (time.time() + self.lease_seconds, time.time(), job.id, job.attempts)
+        )
+
+    def complete(self, job):
+        self.connection.execute(
+            "UPDATE jobs SET status = 'done', error = NULL, leased_until = NULL, updated_at = ? "
+            'WHERE id = ? AND attempts = ?',
+            (time.time(), job.id, job.attempts)
+        )
+
+    def fail(self, job, error):
+        now = time.time()
+        if job.attempts >= job.max_attempts:
+            status, available_at = 'failed', None
+        else:
+            backoff = min(self.max_backoff_seconds, self.backoff_seconds * 2 ** (job.attempts - 1))
+            status, available_at = 'queued', now + backoff
+        self.connection.execute(
+            'UPDATE jobs SET status = ?, error = ?, available_at = ?, leased_until = NULL, updated_at = ? '
+            'WHERE id = ? AND attempts = ?',
+            (status, str(error), available_at, now, job.id, job.attempts)
+        )
+
+    def pending(self):
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')"
+        ).fetchone()[0]
+
+    def counts(self):
+        rows = self.connection.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+        return dict(rows)
+
+
+class JobWorkerPool():
+
+    def __init__(self, queue, workers=4, poll_interval=1.0, **adapter_options):
+        self.queue = queue
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.adapter_options = adapter_options
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def keepalive(self, job, done):
+        interval = max(self.queue.lease_seconds / 3, 0.01)
+        while not done.wait(interval):
+            self.queue.heartbeat(job)
+
+    def runJob(self, job):
+        done = threading.Event()
+        keepalive = threading.Thread(target=self.keepalive, args=(job, done), daemon=True)
+        keepalive.start()
+        try:
+            job.run(**self.adapter_options)
+        finally:
+            done.set()
+            keepalive.join()
+
+    def work(self, name, until_empty):
+        while not self._stop.is_set():
+            job = self.queue.claim(worker=name)
+            if job is None:
+                if until_empty and self.queue.pending() == 0:
+                    return
+                self._stop.wait(self.poll_interval)
+                continue
+            try:
+                self.runJob(job)
+            except Exception as error:
+                self.queue.fail(job, error)
+            else:
+                self.queue.complete(job)
+
+    def run(self, until_empty=True):
+        threads = [
+            threading.Thread(target=self.work, args=(f'worker-{i}', until_empty), daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
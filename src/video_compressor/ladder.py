@@ -0,0 +1,91 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from video_compressor.exceptions import InvalidVideoInput
+import video_compressor.functions as vfunctions
+
+
+def formatBitrate(bitrate):
+    if bitrate >= 1000 * 1000:
+        return f'{round(bitrate / 1000 / 100) / 10:g}M'
+    return f'{round(bitrate / 1000)}k'
+
+
+class LadderBuilder():
+
+    Widths = [480, 640, 960, 1280, 1920, 2560, 3840]
+
+    def __init__(
+        self,
+        video,
+        widths=None,
+        crf=23,
+        samples=3,
+        sampleInMilliseconds=2000,
+        headroom=1.2,
+        min_step=1.5,
+        max_workers=None,
+    ):
+        self.video = video
+        self.widths = sorted(widths or LadderBuilder.Widths)
+        self.crf = crf
+        self.samples = samples
+        self.sampleInMilliseconds = sampleInMilliseconds
+        self.headroom = headroom
+        self.min_step = min_step
+        self.max_workers = max_workers
+
+    def sourceWidth(self):
+        crop_size = self.video.options()['crop_size']
+        if crop_size:
+            return crop_size[0]
+        return self.video.probed.getResolution()[0]
+
+    def candidateWidths(self):
+        source = self.sourceWidth()
+        widths = [w for w in self.widths if w < source]
+        return widths + [source]
+
+    def windows(self):
+        windows = vfunctions.sampleWindows(
+            0, self.video.probed.getDurationInMilliseconds(), self.samples, self.sampleInMilliseconds
+        )
+        if not windows:
+            raise InvalidVideoInput('Cannot sample a video without duration')
+        return windows
+
+    def trial(self, width, window):
+        start, duration = window
+        adapter = self.video.scale(width).compressor_adapter
+        size, elapsed = adapter.trial(start, duration, crf=self.crf, preset='veryfast')
+        return size * 8 * 1000 / duration
+
+    def measure(self):
+        widths = self.candidateWidths()
+        windows = self.windows()
+        jobs = [(width, window) for width in widths for window in windows]
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            bitrates = list(executor.map(lambda job: self.trial(*job), jobs))
+
+        return {
+            width: sum(bitrates[i * len(windows):(i + 1) * len(windows)]) / len(windows)
+            for i, width in enumerate(widths)
+        }
+
+    def build(self):
+        measures = self.measure()
+        ceiling = self.video.probed.getVideoBitrate() or float('inf')
+
+        rungs = []
+        for width, bitrate in sorted(measures.items()):
+            bitrate = min(bitrate * self.headroom, ceiling)
+            if rungs and bitrate < rungs[-1][1] * self.min_step:
+                if width != max(measures):
+                    continue
+                rungs.pop()
+            rungs.append((width, bitrate))
+
+        return [
+            {'scale': [width, -1], 'bitrate': formatBitrate(bitrate), 'suffix': f'@{width}w'}
+            for width, bitrate in rungs
+        ]
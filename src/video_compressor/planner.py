@@ -0,0 +1,96 @@
+import os
+import math
+from fractions import Fraction
+
+
+RATE_CONTROL = ('bitrate', 'crf', 'quality', 'codec_preset', 'codec_pass', 'target_size')
+
+
+def resolveScale(scale, size):
+    w, h = scale
+    sw, sh = size
+    if w == -1 and h == -1:
+        return tuple(size)
+    if w == -1:
+        w = math.trunc(h * sw / sh / 2) * 2
+    if h == -1:
+        h = math.trunc(w * sh / sw / 2) * 2
+    return (w, h)
+
+
+class ExportPlan():
+
+    def __init__(self, options, info, output=None):
+        self.requested = dict(options)
+        self.info = info
+        self.output = output
+
+    @property
+    def resolution(self):
+        return tuple(self.info.getResolution())
+
+    @property
+    def frameRate(self):
+        return Fraction(self.info.getFrameRate())
+
+    def isNoopCrop(self):
+        origin, size = self.requested.get('crop_origin'), self.requested.get('crop_size')
+        if not origin and not size:
+            return True
+        return tuple(origin or (0, 0)) == (0, 0) and tuple(size) == self.resolution
+
+    @property
+    def size(self):
+        return self.resolution if self.isNoopCrop() else tuple(self.requested['crop_size'])
+
+    def isNoopScale(self):
+        scale = self.requested.get('scale')
+        return not scale or resolveScale(scale, self.size) == self.size
+
+    def isNoopFps(self):
+        fps = self.requested.get('fps')
+        return not fps or Fraction(fps) == self.frameRate
+
+    def decimates(self):
+        fps = self.requested.get('fps')
+        return not fps or not self.frameRate or Fraction(fps) < self.frameRate
+
+    @property
+    def filterOrder(self):
+        # dropping frames before scaling saves scaling the frames that are dropped, while
+        # duplicated frames are cheaper to copy once scaled
+        return ('crop', 'fps', 'scale') if self.decimates() else ('crop', 'scale', 'fps')
+
+    @property
+    def options(self):
+        options = dict(self.requested)
+        if self.isNoopCrop():
+            options.update(crop_origin=None, crop_size=None)
+        if self.isNoopScale():
+            options['scale'] = None
+        if self.isNoopFps():
+            options['fps'] = None
+        return options
+
+    def sameContainer(self):
+        input = self.requested.get('input')
+        if self.output is None or not isinstance(input, (str, os.PathLike)):
+            return False
+        return os.path.splitext(input)[1].lower() == os.path.splitext(self.output)[1].lower()
+
+    @property
+    def copyVideo(self):
+        options = self.options
+        transforms = ('crop_size', 'scale', 'fps') + RATE_CONTROL
+        return self.sameContainer() and not any(options.get(key) for key in transforms)
+
+    @property
+    def copyAudio(self):
+        return self.sameContainer() and not self.requested.get('mute') and not self.requested.get('audio_bitrate')
+
+    def adapterOptions(self):
+        return {
+            'copy_video': self.copyVideo,
+            'copy_audio': self.copyAudio,
+            'filter_order': self.filterOrder,
+        }
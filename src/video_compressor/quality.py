@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from video_compressor.exceptions import InvalidVideoInput
+import video_compressor.functions as vfunctions
+
+
+class QualityMeter():
+
+    def __init__(self, video, samples=3, sampleInMilliseconds=2000, max_workers=None, workdir=None):
+        self.video = video
+        self.samples = samples
+        self.sampleInMilliseconds = sampleInMilliseconds
+        self.max_workers = max_workers
+        self.owned = workdir is None
+        self.workdir = tempfile.mkdtemp(prefix='video_compressor-quality-') if self.owned else workdir
+        self._references = {}
+        self._lock = threading.Lock()
+        self._counter = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.owned:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def windows(self):
+        windows = vfunctions.sampleWindows(
+            0, self.video.info.getDurationInMilliseconds(), self.samples, self.sampleInMilliseconds
+        )
+        if not windows:
+            raise InvalidVideoInput('Cannot sample a video without duration')
+        return windows
+
+    def path(self, prefix, ext):
+        with self._lock:
+            self._counter += 1
+            return os.path.join(self.workdir, f'{prefix}-{self._counter}{ext}')
+
+    def reference(self, rendition, window):
+        options = rendition.options()
+        key = (window, options['crop_origin'], options['crop_size'], options['fps'])
+        with self._lock:
+            event = self._references.get(key)
+            owner = event is None
+            if owner:
+                event = self._references[key] = [threading.Event(), None]
+        if owner:
+            try:
+                output = self.path('reference', '.mkv')
+                rendition.compressor_adapter.reference(output, *window)
+                if os.path.exists(output):
+                    event[1] = output
+            finally:
+                event[0].set()
+        event[0].wait()
+        if event[1] is None:
+            raise InvalidVideoInput(f'Cannot decode {window} from {self.video.options()["input"]}')
+        return event[1]
+
+    def sample(self, rendition, window):
+        reference = self.reference(rendition, window)
+        distorted = self.path('sample', '.mp4')
+        adapter = rendition.compressor_adapter
+        adapter.exportSample(reference, distorted)
+        try:
+            return adapter.compare(distorted, reference)
+        finally:
+            os.remove(distorted)
+
+    def measure(self, rendition=None):
+        rendition = rendition or self.video
+        windows = self.windows()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            scores = list(executor.map(lambda window: self.sample(rendition, window), windows))
+        return {
+            'ssim': sum(ssim for ssim, psnr in scores) / len(scores),
+            'psnr': sum(psnr for ssim, psnr in scores) / len(scores),
+        }
+
+    def searchCrf(self, rendition, target, metric='ssim', low=16, high=40):
+        best = low
+        while low <= high:
+            crf = (low + high) // 2
+            if self.measure(rendition.crf(crf))[metric] >= target:
+                best, low = crf, crf + 1
+            else:
+                high = crf - 1
+        return best
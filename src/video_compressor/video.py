@@ -1,21 +1,61 @@
 import os
-from video_compressor.adapters.ffmpeg import ffmpegVideoCompressorAdapter, ffmpegProbeVideoInfoAdapter
+import math
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Executor, as_completed
+from video_compressor.adapters.ffmpeg import (
+    ffmpegVideoCompressorAdapter,
+    ffmpegProbeVideoInfoAdapter,
+    ffmpegSegmentVideoInfoAdapter
+)
+from video_compressor.exceptions import TargetSizeError, InvalidVideoInput
+from video_compressor.audio import AudioAnalyzer
+from video_compressor.frames import frameSize, frameRing
+from video_compressor.ladder import LadderBuilder
+from video_compressor.quality import QualityMeter
+from video_compressor.planner import ExportPlan
 import video_compressor.functions as vfunctions
 
+def exportVideo(video, output):
+    video.export(output)
+    return video
+
+
 class VideoInfo():
 
     @classmethod
     def defaultInfoAdapter(cls):
         return ffmpegProbeVideoInfoAdapter
 
-    def __init__(self, path, adapter=None, **options):
+    def __init__(self, path, adapter=None, defer_integrity=False, **options):
         self.path = path
         self.adapter = adapter or VideoInfo.defaultInfoAdapter()(input=path, **options)
-        self.adapter.check_video_integrity(path)
+        if not defer_integrity:
+            self.checkIntegrity()
+
+    def checkIntegrity(self, level=None):
+        if level is None:
+            return self.adapter.check_video_integrity(self.path)
+        return self.adapter.check_video_integrity(self.path, level=level)
+
+    async def checkIntegrityAsync(self, level=None, semaphore=None):
+        await self.adapter.check_video_integrity_async(self.path, level=level, semaphore=semaphore)
 
     def volumedetect(self):
         return self.adapter.volumedetect()
 
+    def hasAudio(self):
+        return self.adapter.hasAudioStream()
+
+    def analyzeAudio(self, sample_rate=16000, **options):
+        analyzer = AudioAnalyzer(sample_rate=sample_rate, **options)
+        if not self.hasAudio():
+            return analyzer.analysis()
+        return analyzer.analyze(self.adapter.pcm(sample_rate))
+
+    def frames(self, pix_fmt='rgb24', stride=1, ring=4):
+        width, height = self.getResolution()
+        return self.adapter.frames(frameRing(width, height, pix_fmt, ring), pix_fmt=pix_fmt, stride=stride)
+
     def getVideoBitrate(self):
         return self.adapter.getVideoBitrate()
 
@@ -39,25 +79,105 @@ class VideoInfo():
     def getSize(self):
         return self.adapter.getSize()
 
+    def probe(self):
+        if hasattr(self.adapter, 'probe'):
+            self.adapter.probe()
+        return self
+
+    async def probeAsync(self, semaphore=None):
+        await self.adapter.probeAsync(semaphore=semaphore)
+        return self
+
     def getFramePerSeconds(self):
         return self.adapter.getFramePerSeconds()
 
+    def getFrameRate(self):
+        return self.adapter.getFrameRate()
+
+    def getPacketIndex(self):
+        return self.adapter.packetIndex()
+
     def isFragmented(self):
         return self.adapter.isFragmented()
+
+
+class AsyncVideoInfo(VideoInfo):
+
+    def __init__(self, path, adapter=None, **options):
+        options.pop('defer_integrity', None)
+        super().__init__(path, adapter=adapter, defer_integrity=True, **options)
+
+    @classmethod
+    async def open(cls, path, semaphore=None, defer_integrity=False, **options):
+        info = cls(path, **options)
+        if not defer_integrity:
+            await info.checkIntegrityAsync(semaphore=semaphore)
+        return await info.probeAsync(semaphore=semaphore)
+
 class VideoInfoCollection():
 
-    def __init__(self, videos=None):
-        self._videos = [VideoInfo(video) for video in (videos or [])]
+    def __init__(self, videos=None, max_workers=None, **adapter_options):
+        self._videos = []
+        self.errors = []
+        if videos:
+            self.extend(videos, max_workers=max_workers, raise_errors=True, **adapter_options)
+
+    @classmethod
+    def probe(cls, videos, max_workers=None, **adapter_options):
+        collection = cls()
+        collection.extend(videos, max_workers=max_workers, **adapter_options)
+        return collection
 
     def __len__(self):
         return len(self._videos)
 
+    def __iter__(self):
+        return iter(self._videos)
+
+    def __getitem__(self, index):
+        return self._videos[index]
+
     def append(self, video, adapter_options={}):
-        self._videos.append(VideoInfo(video, **adapter_options))
+        if not isinstance(video, VideoInfo):
+            video = VideoInfo(video, **adapter_options)
+        self._videos.append(video)
+
+    def extend(self, videos, max_workers=None, raise_errors=False, **adapter_options):
+        videos = list(videos)
+
+        def probe(video):
+            try:
+                return VideoInfo(video, **adapter_options).probe(), None
+            except Exception as error:
+                return None, error
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(probe, videos))
+
+        for video, (info, error) in zip(videos, results):
+            if error is not None:
+                if raise_errors:
+                    raise error
+                self.errors.append((video, error))
+            else:
+                self._videos.append(info)
+
+        return self
 
     def getDurationInMicroseconds(self):
         return sum(map(lambda s: s.getDurationInMicroseconds(), self._videos))
 
+    def getSize(self):
+        return sum(map(lambda s: s.getSize(), self._videos))
+
+    def getMeanVideoBitrate(self):
+        durations = [s.getDurationInMicroseconds() for s in self._videos]
+        total = sum(durations)
+        if total == 0:
+            return 0
+        bitrates = [s.getVideoBitrate() for s in self._videos]
+        return round(sum(b * d for b, d in zip(bitrates, durations)) / total)
+
 
 class VideoCompressor():
 
@@ -68,6 +188,9 @@ class VideoCompressor():
         {'scale':[1280, -1], 'bitrate': '3M', 'fps': 24, 'suffix':'@xl'},
     ]
 
+    AudioBitrateBudget = 128000
+    ContainerEfficiency = 0.98
+
     @classmethod
     def defaultCompressorAdapter(cls):
         return ffmpegVideoCompressorAdapter
@@ -82,7 +205,11 @@ class VideoCompressor():
         crop_size=None,
         fps=None,
         codec_preset=None,
+        codec_pass=None,
         quality=None,
+        crf=None,
+        target_size=None,
+        audio_bitrate=None,
         suffix="",
         adapter=None,
         **adapter_options,
@@ -95,9 +222,16 @@ class VideoCompressor():
         self._crop_size = crop_size
         self._fps = fps
         self._codec_preset = codec_preset
+        self._codec_pass = codec_pass
         self._quality = quality
+        self._crf = crf
+        self._target_size = target_size
+        self._audio_bitrate = audio_bitrate
         self._suffix = suffix
         self._adapter_options = adapter_options
+        self._info = None
+        self._probed = None
+        self._plan = None
 
         self.VideoCompressorAdapter = adapter or VideoCompressor.defaultCompressorAdapter()
 
@@ -107,18 +241,37 @@ class VideoCompressor():
             input=self._input,
             mute=self._mute,
             scale=self._scale,
-            bitrate=self._bitrate,
+            bitrate=self.targetBitrate() if self._target_size else self._bitrate,
             crop_origin=self._crop_origin,
             crop_size=self._crop_size,
             codec_preset=self._codec_preset,
+            codec_pass=self._codec_pass,
             quality=self._quality,
+            crf=self._crf,
             fps=self._fps,
+            audio_bitrate=self._audio_bitrate,
+            **(self._plan.adapterOptions() if self._plan else {}),
             **self._adapter_options
         )
 
     @property
     def info(self):
-        return VideoInfo(self._input, **self._adapter_options)
+        if self._info is None:
+            if not self.hasPathInput():
+                raise InvalidVideoInput('Reading video info needs a file path input, a streamed input can only be exported')
+            self._info = VideoInfo(self._input, **self._adapter_options)
+        return self._info
+
+    @property
+    def probed(self):
+        # the probed metadata without the integrity check of info, which decodes the whole source
+        if self._info is not None:
+            return self._info
+        if self._probed is None:
+            if not self.hasPathInput():
+                raise InvalidVideoInput('Reading video info needs a file path input, a streamed input can only be exported')
+            self._probed = VideoInfo(self._input, defer_integrity=True, **self._adapter_options)
+        return self._probed
 
     def options(self):
         return {
@@ -129,7 +282,11 @@ class VideoCompressor():
             'crop_origin': self._crop_origin,
             'crop_size': self._crop_size,
             'codec_preset': self._codec_preset,
+            'codec_pass': self._codec_pass,
             'quality': self._quality,
+            'crf': self._crf,
+            'target_size': self._target_size,
+            'audio_bitrate': self._audio_bitrate,
             'fps': self._fps,
         }
 
@@ -160,19 +317,202 @@ class VideoCompressor():
     def codecPreset(self, codec_preset):
         return self.update(codec_preset=codec_preset)
 
+    def codecPass(self, codec_pass):
+        return self.update(codec_pass=codec_pass)
+
     def quality(self, quality):
         return self.update(quality=quality)
 
-    def export(self, output):
+    def crf(self, crf):
+        return self.update(crf=crf)
+
+    def measureQuality(self, meter=None, **options):
+        if meter is not None:
+            return meter.measure(self)
+        with QualityMeter(self, **options) as meter:
+            return meter.measure(self)
+
+    def searchCrf(self, target, metric='ssim', meter=None, **options):
+        if meter is not None:
+            return self.crf(meter.searchCrf(self, target, metric=metric))
+        with QualityMeter(self, **options) as meter:
+            return self.crf(meter.searchCrf(self, target, metric=metric))
+
+    def targetSize(self, target_size):
+        return self.update(target_size=target_size)
+
+    def audioBitrate(self, audio_bitrate):
+        return self.update(audio_bitrate=audio_bitrate)
+
+    def audioBudget(self):
+        if self._mute or not self.probed.hasAudio():
+            return 0
+        return VideoCompressor.AudioBitrateBudget
+
+    def targetBitrate(self, target_size=None):
+        seconds = self.probed.getDurationInMicroseconds() / 1000 / 1000
+        bits = (target_size or self._target_size) * 8 * VideoCompressor.ContainerEfficiency
+        return max(1, math.floor(bits / seconds - self.audioBudget()))
+
+    def outputPath(self, output):
         filename, ext = os.path.splitext(output)
-        return self.compressor_adapter.export(f'{filename}{self._suffix}{ext}')
+        return f'{filename}{self._suffix}{ext}'
+
+    @property
+    def export_cache(self):
+        return self._adapter_options.get('export_cache')
 
-    def fragment(self, output):
-        return self.compressor_adapter.fragment(output)
+    def exportCacheKey(self, output):
+        adapter = self.compressor_adapter
+        version = adapter.version() if hasattr(adapter, 'version') else type(adapter).__name__
+        return self.export_cache.key(self._input, self.options(), version, output)
 
-    def slice(self, output, stepInMilliseconds=1000):
-        
-        videos = VideoInfoCollection()
+    def restoreExport(self, output):
+        cache = self.export_cache
+        return cache is not None and self.hasPathInput() and cache.fetch(self.exportCacheKey(output), output)
+
+    def storeExport(self, output):
+        if self.export_cache is not None and self.hasPathInput():
+            self.export_cache.store(self.exportCacheKey(output), output)
+
+    def plan(self, output=None, info=None):
+        return ExportPlan(self.options(), info or self.probed, output=output)
+
+    def hasPathInput(self):
+        return isinstance(self._input, (str, os.PathLike))
+
+    def plannable(self):
+        return getattr(self.VideoCompressorAdapter, 'stream_copy', False) and self.hasPathInput()
+
+    def planned(self, output, info=None):
+        if not self.plannable():
+            return self
+        plan = self.plan(output, info=info)
+        video = self.update(**plan.options)
+        video._plan = plan
+        return video
+
+    def export(self, output, progress=None):
+        output = self.outputPath(output)
+        if self._target_size:
+            return self.exportTargetSize(output, progress=progress)
+        if self.restoreExport(output):
+            return None
+        if progress is None:
+            result = self.planned(output).compressor_adapter.export(output)
+        else:
+            info = self.probed if self.hasPathInput() else None
+            result = self.planned(output, info=info).compressor_adapter.export(
+                output,
+                progress=progress,
+                durationInMicroseconds=info.getDurationInMicroseconds() if info else None
+            )
+        self.storeExport(output)
+        return result
+
+    def targetSized(self, bitrate):
+        # the audio is encoded at the budget reserved by targetBitrate instead of copied at the source bitrate
+        return self.update(bitrate=bitrate, audio_bitrate=self.audioBudget() or None, target_size=None)
+
+    def exportTargetSize(self, output, progress=None, attempts=3):
+        bitrate = self.targetBitrate()
+        for attempt in range(attempts):
+            if os.path.exists(output):
+                os.remove(output)
+            self.targetSized(bitrate).export(output, progress=progress)
+            size = os.path.getsize(output)
+            if size <= self._target_size:
+                return
+            bitrate = max(1, math.floor(bitrate * self._target_size / size * VideoCompressor.ContainerEfficiency))
+        raise TargetSizeError(f'{output} is {size} bytes, above the target of {self._target_size} bytes')
+
+    async def exportTargetSizeAsync(self, output, semaphore=None, attempts=3):
+        if self._probed is None and self._info is None:
+            self._probed = await AsyncVideoInfo.open(
+                self._input, semaphore=semaphore, defer_integrity=True, **self._adapter_options
+            )
+        bitrate = self.targetBitrate()
+        for attempt in range(attempts):
+            if os.path.exists(output):
+                os.remove(output)
+            await self.targetSized(bitrate).exportAsync(output, semaphore=semaphore)
+            size = os.path.getsize(output)
+            if size <= self._target_size:
+                return
+            bitrate = max(1, math.floor(bitrate * self._target_size / size * VideoCompressor.ContainerEfficiency))
+        raise TargetSizeError(f'{output} is {size} bytes, above the target of {self._target_size} bytes')
+
+    def predictExport(self, samples=3, sampleInMilliseconds=2000):
+        durationInMilliseconds = self.probed.getDurationInMilliseconds()
+        windows = vfunctions.sampleWindows(0, durationInMilliseconds, samples, sampleInMilliseconds)
+        adapter = self.compressor_adapter
+        trials = [adapter.trial(start, duration) for start, duration in windows]
+
+        ratio = durationInMilliseconds / sum(duration for start, duration in windows)
+        passes = 2 if self._codec_pass == 2 and (self._bitrate or self._target_size) else 1
+        audio = self.audioBudget() * durationInMilliseconds / 1000 / 8
+
+        return {
+            'size': round(sum(size for size, elapsed in trials) * ratio + audio),
+            'seconds': sum(elapsed for size, elapsed in trials) * ratio * passes,
+        }
+
+    def exportProgress(self, output):
+        output = self.outputPath(output)
+        info = self.probed if self.hasPathInput() else None
+        return self.planned(output, info=info).compressor_adapter.exportProgress(
+            output,
+            info.getDurationInMicroseconds() if info else None
+        )
+
+    async def exportAsync(self, output, semaphore=None):
+        output = self.outputPath(output)
+        if self._target_size:
+            return await self.exportTargetSizeAsync(output, semaphore=semaphore)
+        video = self
+        if self.plannable():
+            info = await AsyncVideoInfo.open(
+                self._input, semaphore=semaphore, defer_integrity=True, **self._adapter_options
+            )
+            video = self.planned(output, info=info)
+        return await video.compressor_adapter.exportAsync(output, semaphore=semaphore)
+
+    def exportStream(self, output=None, format='mp4', chunk_size=64 * 1024):
+        chunks = self.compressor_adapter.exportStream(format=format, chunk_size=chunk_size)
+        if output is None:
+            return chunks
+        for chunk in chunks:
+            output.write(chunk)
+
+    def exportStreamAsync(self, format='mp4', chunk_size=64 * 1024):
+        return self.compressor_adapter.exportStreamAsync(format=format, chunk_size=chunk_size)
+
+    def fragment(self, output, progress=None):
+        if progress is None:
+            return self.compressor_adapter.fragment(output)
+        info = self.probed if self.hasPathInput() else None
+        return self.compressor_adapter.fragment(
+            output,
+            progress=progress,
+            durationInMicroseconds=info.getDurationInMicroseconds() if info else None
+        )
+
+    def package(self, directory, settings=None, format='hls', segmentInMilliseconds=4000):
+        videos = [self.update(**setting) for setting in (settings or VideoCompressor.WebSettings)]
+        return self.compressor_adapter.package(
+            [video.compressor_adapter for video in videos],
+            directory,
+            format=format,
+            segmentInMilliseconds=segmentInMilliseconds,
+            audio=not self._mute and self.info.hasAudio(),
+        )
+
+    def slice(self, output, stepInMilliseconds=1000, progress=None, segment=False, copy=False, index=False):
+
+        if segment:
+            return self.sliceSegments(output, stepInMilliseconds, copy=copy)
+
+        paths = []
         path, ext = os.path.splitext(output)
         durationInMilliseconds = self.info.getDurationInMilliseconds()
 
@@ -182,16 +522,166 @@ class VideoCompressor():
             stepInMilliseconds
         )
 
+        packets = self.info.getPacketIndex() if index else None
+
         for i, step in enumerate(steps):
             start, duration = step
             step_path = f'{path}-{i}{ext}'
-            self.compressor_adapter.slice(step_path, start, duration)
-            videos.append(step_path, self._adapter_options)
+            seek = packets.keyframeBefore(start * 1000) / 1000 if packets else None
+            if progress is None:
+                self.compressor_adapter.slice(step_path, start, duration, seekInMilliseconds=seek)
+            else:
+                self.compressor_adapter.slice(step_path, start, duration, progress=progress, seekInMilliseconds=seek)
+            paths.append(step_path)
+
+        return VideoInfoCollection().extend(paths, raise_errors=True, **self._adapter_options)
+
+    def frames(self, pix_fmt='rgb24', stride=1, ring=4):
+        width, height = frameSize(self.info.getResolution(), self._crop_size, self._scale)
+        return self.compressor_adapter.frames(frameRing(width, height, pix_fmt, ring), pix_fmt=pix_fmt, stride=stride)
+
+    def thumbnails(
+        self,
+        output,
+        timesInMilliseconds=None,
+        intervalInMilliseconds=10000,
+        width=160,
+        columns=10,
+        exact=False,
+    ):
+        path, ext = os.path.splitext(output)
+        durationInMilliseconds = self.probed.getDurationInMilliseconds()
+
+        source_width, source_height = self._crop_size or self.probed.getResolution()
+        size = (width, max(2, round(width * source_height / source_width / 2) * 2))
+
+        if timesInMilliseconds is not None:
+            count = len(timesInMilliseconds)
+        else:
+            count = math.ceil(durationInMilliseconds / intervalInMilliseconds)
+        layout = (min(columns, max(1, count)), max(1, math.ceil(count / columns)))
+
+        sprite = f'{path}-sprite{ext}'
+        times = self.compressor_adapter.thumbnails(
+            f'{path}-%d{ext}',
+            sprite,
+            size,
+            layout,
+            timesInMilliseconds=timesInMilliseconds,
+            intervalInMilliseconds=intervalInMilliseconds,
+            exact=exact,
+        )
+
+        cues = ['WEBVTT', '']
+        for i, time in enumerate(times):
+            start = 0 if i == 0 else time
+            end = times[i + 1] if i + 1 < len(times) else durationInMilliseconds
+            x, y = i % layout[0] * size[0], i // layout[0] * size[1]
+            cues.append(f'{vfunctions.formatTimestamp(start)} --> {vfunctions.formatTimestamp(end)}')
+            cues.append(f'{os.path.basename(sprite)}#xywh={x},{y},{size[0]},{size[1]}')
+            cues.append('')
+
+        vtt = f'{path}.vtt'
+        with open(vtt, 'w') as f:
+            f.write('\n'.join(cues))
+
+        return {
+            'thumbnails': [(f'{path}-{i}{ext}', time) for i, time in enumerate(times)],
+            'sprite': sprite,
+            'vtt': vtt,
+        }
+
+    def sliceSegments(self, output, stepInMilliseconds=1000, copy=False):
+
+        videos = VideoInfoCollection()
+        path, ext = os.path.splitext(output)
+        durationInMicroseconds = self.info.getDurationInMicroseconds()
+
+        steps = vfunctions.rangeSliceBySteps(0, self.info.getDurationInMilliseconds(), stepInMilliseconds)
+        times = [start for start, duration in steps][1:]
+        streams = ['-map', '0:v:0'] if self._mute else ['-map', '0:v:0', '-map', '0:a:0?']
+
+        segments = self.compressor_adapter.segment(f'{path}-%d{ext}', times, copy=copy, streams=streams)
+
+        for segment_path, start, end in segments:
+            adapter = ffmpegSegmentVideoInfoAdapter(
+                input=segment_path,
+                startInMicroseconds=round(start * 1000 * 1000),
+                endInMicroseconds=min(round(end * 1000 * 1000), durationInMicroseconds),
+                **self._adapter_options
+            )
+            videos.append(VideoInfo(segment_path, adapter=adapter))
 
         return videos
 
-    def exportCollection(self, output, settings):
+    def exportChunked(self, output, chunkInMilliseconds=60000, max_workers=None, workdir=None):
+        output = self.outputPath(output)
+        if self.restoreExport(output):
+            return
+        ext = os.path.splitext(output)[1]
+        durationInMilliseconds = self.probed.getDurationInMilliseconds()
+
+        steps = vfunctions.rangeSliceBySteps(0, durationInMilliseconds, chunkInMilliseconds)
+        times = [start for start, duration in steps][1:]
+
+        with tempfile.TemporaryDirectory(dir=workdir) as directory:
+            segments = self.compressor_adapter.segment(os.path.join(directory, f'chunk-%05d{ext}'), times)
+            # the target size spans the whole video, each chunk gets its share as a bitrate
+            video = self.targetSized(self.targetBitrate()) if self._target_size else self
+            # chunk encodes are temporary files that can never be hit again, only the joined output is cached
+            adapter_options = {k: v for k, v in self._adapter_options.items() if k != 'export_cache'}
+            chunks = [
+                VideoCompressor(
+                    **{**video.options(), 'input': path, 'mute': True},
+                    adapter=self.VideoCompressorAdapter,
+                    **adapter_options
+                )
+                for path, start, end in segments
+            ]
+            encoded = [os.path.join(directory, f'encoded-{i:05d}{ext}') for i in range(len(chunks))]
+
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                list(executor.map(exportVideo, chunks, encoded))
+
+            video.compressor_adapter.concat(encoded, output)
+
+        self.storeExport(output)
+
+    def buildLadder(self, **options):
+        return LadderBuilder(self, **options).build()
+
+    def exportCollection(self, output, settings, single_decode=False):
+        if single_decode:
+            videos = [self.update(**setting) for setting in settings]
+            pending = [video for video in videos if not video.restoreExport(video.outputPath(output))]
+            if pending:
+                self.compressor_adapter.exportSplit([
+                    (video.compressor_adapter, video.outputPath(output)) for video in pending
+                ])
+            for video in pending:
+                video.storeExport(video.outputPath(output))
+            yield from videos
+            return
+
         for setting in settings:
             video = self.update(**setting)
             video.export(output)
             yield video
+
+    def exportCollectionParallel(self, output, settings, max_workers=None, executor='thread'):
+        executors = {'thread': ThreadPoolExecutor, 'process': ProcessPoolExecutor}
+        owned = not isinstance(executor, Executor)
+        pool = executors[executor](max_workers=max_workers) if owned else executor
+
+        futures = {}
+        try:
+            for setting in settings:
+                video = self.update(**setting)
+                futures[pool.submit(exportVideo, video, output)] = video
+            for future in as_completed(futures):
+                yield futures[future], future.exception()
+        finally:
+            for future in futures:
+                future.cancel()
+            if owned:
+                pool.shutdown(wait=True)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+import os
+import pickle
+
+import video_compressor as vp
+
+__author__ = "Lenselle Nicolas"
+__copyright__ = "Lenselle Nicolas"
+__license__ = "mit"
+
+
+def test_probe_cache_hit_and_invalidation(tmp_path):
+    video = tmp_path / 'video.mp4'
+    video.write_bytes(b'first')
+    cache = vp.ProbeCache(str(tmp_path / 'probe.sqlite'))
+
+    assert cache.get(str(video)) is None
+    cache.set(str(video), {'streams': []})
+    assert cache.get(str(video)) == {'streams': []}
+    assert cache.get(str(video), namespace='integrity') is None
+
+    video.write_bytes(b'second content')
+    os.utime(video, ns=(1, 1))
+    assert cache.get(str(video)) is None
+    assert cache.stats() == {'hits': 1, 'misses': 3, 'entries': 1}
+
+
+def test_probe_cache_lru_eviction(tmp_path):
+    cache = vp.ProbeCache(str(tmp_path / 'probe.sqlite'), max_entries=2)
+    paths = []
+    for i in range(3):
+        path = tmp_path / f'video-{i}.mp4'
+        path.write_bytes(b'x' * i)
+        paths.append(str(path))
+
+    cache.set(paths[0], 0)
+    cache.set(paths[1], 1)
+    cache.get(paths[0])
+    cache.set(paths[2], 2)
+
+    assert len(cache) == 2
+    assert cache.get(paths[1]) is None
+    assert cache.get(paths[0]) == 0
+
+    assert pickle.loads(pickle.dumps(cache)).get(paths[2]) == 2
+
+
+def test_probe_cache_hashes_content_once(tmp_path):
+    from video_compressor.cache import content_digest
+
+    cache = vp.ProbeCache(str(tmp_path / 'probe.sqlite'), content_hash=True)
+    content_digest.cache_clear()
+    for i in range(3):
+        vp.VideoInfo('./tests/sample.mp4', probe_cache=cache, integrity='header').getResolution()
+
+    assert content_digest.cache_info().misses == 1
+    assert cache.stats() == {'hits': 4, 'misses': 2, 'entries': 2}
+
+
+class CountingCompressorAdapter():
+
+    exports = []
+
+    def __init__(self, input=None, bitrate=None, **options):
+        self.bitrate = bitrate
+
+    def export(self, output):
+        CountingCompressorAdapter.exports.append(output)
+        with open(output, 'w') as f:
+            f.write(str(self.bitrate))
+
+
+def test_export_cache_skips_redundant_encodes(tmp_path):
+    source = tmp_path / 'source.mp4'
+    source.write_bytes(b'source')
+    cache = vp.ExportCache(str(tmp_path / 'exports'))
+    CountingCompressorAdapter.exports = []
+
+    video = vp.VideoCompressor(str(source), adapter=CountingCompressorAdapter, export_cache=cache)
+    video.bitrate('1M').export(str(tmp_path / 'a.mp4'))
+    video.bitrate(1000000).export(str(tmp_path / 'b.mp4'))
+    video.bitrate('2M').export(str(tmp_path / 'c.mp4'))
+
+    assert len(CountingCompressorAdapter.exports) == 2
+    assert (tmp_path / 'b.mp4').read_text() == '1M'
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['entries'] == 2
+
+    settings = [{'bitrate': '1M', 'suffix': '@a'}, {'bitrate': '3M', 'suffix': '@b'}]
+    list(video.exportCollection(str(tmp_path / 'd.mp4'), settings))
+    assert len(CountingCompressorAdapter.exports) == 3
+
+
+def test_export_cache_size_bounded_eviction(tmp_path):
+    cache = vp.ExportCache(str(tmp_path / 'exports'), max_bytes=10)
+    for i in range(3):
+        output = tmp_path / f'out-{i}.mp4'
+        output.write_bytes(b'x' * 4)
+        cache.store(f'key-{i}.mp4', str(output))
+        os.utime(cache.path(f'key-{i}.mp4'), (i, i))
+
+    assert cache.stats()['entries'] == 2
+    assert not cache.fetch('key-0.mp4', str(tmp_path / 'restored.mp4'))
+    assert cache.fetch('key-2.mp4', str(tmp_path / 'restored.mp4'))
+    assert (tmp_path / 'restored.mp4').read_bytes() == b'x' * 4
+
+
+def test_export_cache_stores_chunked_output_once(tmp_path):
+    cache = vp.ExportCache(str(tmp_path / 'exports'))
+    video = vp.VideoCompressor('./tests/sample.mp4', export_cache=cache).scale(320).bitrate('500k')
+
+    video.exportChunked(str(tmp_path / 'a.mp4'), chunkInMilliseconds=2000)
+    video.exportChunked(str(tmp_path / 'b.mp4'), chunkInMilliseconds=2000)
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (1, 1, 1)
+    assert os.path.getsize(tmp_path / 'b.mp4') == os.path.getsize(tmp_path / 'a.mp4')
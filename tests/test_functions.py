@@ -13,4 +13,12 @@ def test_compute_slice_video_frames():
 
     assert list(functions.rangeSliceBySteps(1, 1, step=1)) == []
     assert list(functions.rangeSliceBySteps(1, 3, step=1)) == [(1, 1), (2, 1)]
-    assert list(functions.rangeSliceBySteps(3, 8, step=2)) == [(3, 2), (5, 2), (7, 1)]
\ No newline at end of file
+    assert list(functions.rangeSliceBySteps(3, 8, step=2)) == [(3, 2), (5, 2), (7, 1)]
+
+def test_sample_windows():
+
+    assert functions.sampleWindows(0, 0, 3, 2) == []
+    assert functions.sampleWindows(0, 1, 3, 2) == [(0, 1)]
+    assert functions.sampleWindows(0, 30, 3, 2) == [(4, 2), (14, 2), (24, 2)]
+    assert functions.sampleWindows(0, 4, 3, 2) == [(0, 2), (1, 2), (2, 2)]
+    assert functions.sampleWindows(10, 40, 1, 4) == [(23, 4)]
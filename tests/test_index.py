@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from video_compressor.index import PacketIndex
+
+__author__ = "Lenselle Nicolas"
+__copyright__ = "Lenselle Nicolas"
+__license__ = "mit"
+
+pytest.importorskip('numpy')
+
+PACKETS = [
+    'pts_time=0.000000|dts_time=-0.066733|size=9000|pos=48|flags=K__\n',
+    'pts_time=0.133467|dts_time=-0.033367|size=700|pos=9048|flags=___\n',
+    'pts_time=0.066733|dts_time=0.000000|size=500|pos=9748|flags=___\n',
+    'pts_time=1.001000|dts_time=0.967633|size=8000|pos=30000|flags=K__\n',
+    'pts_time=N/A|dts_time=N/A|size=12|pos=N/A|flags=___\n',
+    'pts_time=2.002000|dts_time=1.968633|size=7000|pos=61000|flags=K_D\n',
+]
+
+
+def test_packet_index_queries():
+    index = PacketIndex.fromLines(PACKETS)
+
+    assert len(index) == 5
+    assert list(index.pts) == [0, 66733, 133467, 1001000, 2002000]
+    assert list(index.keyframes) == [0, 1001000, 2002000]
+    assert index.keyframeBefore(1500000) == 1001000
+    assert index.keyframeBefore(1001000) == 1001000
+    assert index.keyframeAfter(1001001) == 2002000
+    assert index.keyframeAfter(3000000) is None
+    assert index.offsetBefore(1500000) == 30000
+
+
+def test_packet_index_is_invalidated_on_change(tmp_path):
+    path = str(tmp_path / 'index' / 'video.npz')
+    PacketIndex.fromLines(PACKETS).save(path, ['video.mp4', 100, 1, ''])
+
+    assert list(PacketIndex.load(path, ['video.mp4', 100, 1, '']).keyframes) == [0, 1001000, 2002000]
+    assert PacketIndex.load(path, ['video.mp4', 200, 2, '']) is None
+    assert PacketIndex.load(str(tmp_path / 'missing.npz'), ['video.mp4', 100, 1, '']) is None
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+
+import video_compressor as vp
+
+__author__ = "Lenselle Nicolas"
+__copyright__ = "Lenselle Nicolas"
+__license__ = "mit"
+
+
+class FlakyCompressorAdapter():
+
+    failures = {}
+
+    def __init__(self, input=None, scale=None, **options):
+        self.input = input
+
+    def export(self, output):
+        remaining = FlakyCompressorAdapter.failures.get(self.input, 0)
+        if remaining:
+            FlakyCompressorAdapter.failures[self.input] = remaining - 1
+            raise RuntimeError(f'{self.input} failed')
+        with open(output, 'w') as f:
+            f.write(self.input)
+
+
+class SlowCompressorAdapter():
+
+    runs = 0
+
+    def __init__(self, input=None, scale=None, **options):
+        self.input = input
+
+    def export(self, output):
+        SlowCompressorAdapter.runs += 1
+        time.sleep(1)
+        with open(output, 'w') as f:
+            f.write(self.input)
+
+
+def test_job_queue_priorities_and_retries(tmp_path):
+    queue = vp.JobQueue(str(tmp_path / 'jobs.sqlite'), backoff_seconds=0)
+    video = vp.VideoCompressor('low.mp4')
+
+    low = queue.put(video.options(), str(tmp_path / 'low.mp4'), priority=0)
+    high = queue.put(video.update(input='high.mp4').options(), str(tmp_path / 'high.mp4'), priority=10)
+
+    job = queue.claim('test')
+    assert job.id == high
+    assert job.attempts == 1
+
+    queue.fail(job, RuntimeError('boom'))
+    assert queue.get(high).status == 'queued'
+    assert queue.claim('test').id == high
+    assert queue.claim('test').id == low
+    assert queue.claim('test') is None
+
+
+def test_job_queue_reclaims_expired_leases(tmp_path):
+    queue = vp.JobQueue(str(tmp_path / 'jobs.sqlite'), lease_seconds=-1)
+    id = queue.put({'input': 'video.mp4'}, str(tmp_path / 'out.mp4'), max_attempts=2)
+
+    assert queue.claim('crashed').attempts == 1
+    assert queue.claim('other').attempts == 2
+    assert queue.claim('other') is None
+    assert queue.get(id).status == 'failed'
+
+
+def test_job_worker_pool(tmp_path):
+    queue = vp.JobQueue(str(tmp_path / 'jobs.sqlite'), backoff_seconds=0)
+    FlakyCompressorAdapter.failures = {'flaky.mp4': 1, 'broken.mp4': 5}
+
+    for name in ['ok.mp4', 'flaky.mp4', 'broken.mp4']:
+        queue.put(vp.VideoCompressor(name).options(), str(tmp_path / name), max_attempts=2)
+
+    vp.JobWorkerPool(queue, workers=2, poll_interval=0.01, adapter=FlakyCompressorAdapter).run()
+
+    assert queue.counts() == {'done': 2, 'failed': 1}
+    assert os.path.exists(tmp_path / 'ok.mp4')
+    assert os.path.exists(tmp_path / 'flaky.mp4')
+    assert not os.path.exists(tmp_path / 'broken.mp4')
+
+
+def test_job_worker_pool_renews_leases(tmp_path):
+    queue = vp.JobQueue(str(tmp_path / 'jobs.sqlite'), lease_seconds=0.3)
+    id = queue.put(vp.VideoCompressor('slow.mp4').options(), str(tmp_path / 'slow.mp4'))
+    SlowCompressorAdapter.runs = 0
+
+    vp.JobWorkerPool(queue, workers=2, poll_interval=0.01, adapter=SlowCompressorAdapter).run()
+
+    assert SlowCompressorAdapter.runs == 1
+    assert queue.get(id).attempts == 1
+    assert queue.get(id).status == 'done'
+
+
+def test_job_queue_keys(tmp_path):
+    queue = vp.JobQueue(str(tmp_path / 'jobs.sqlite'))
+
+    first = queue.put({'input': 'video.mp4'}, str(tmp_path / 'out.mp4'), key='out')
+    assert queue.put({'input': 'video.mp4'}, str(tmp_path / 'out.mp4'), key='out') == first
+    assert queue.put({'input': 'video.mp4'}, str(tmp_path / 'out.mp4')) != first
+    assert queue.counts() == {'queued': 2}
+
+
+def test_job_retry_replaces_partial_output(tmp_path):
+    queue = vp.JobQueue(str(tmp_path / 'jobs.sqlite'))
+    output = tmp_path / 'sample.mp4'
+    output.write_bytes(b'partial')
+
+    id = queue.put(vp.VideoCompressor('./tests/sample.mp4').scale(320).options(), str(output))
+    vp.JobWorkerPool(queue, workers=1, poll_interval=0.01).run()
+
+    assert queue.get(id).status == 'done'
+    assert vp.VideoInfo(str(output)).getResolution() == (320, 180)
+    assert not [name for name in os.listdir(tmp_path) if 'partial' in name]
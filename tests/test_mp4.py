@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+import struct
+from fractions import Fraction
+import pytest
+
+import video_compressor as vp
+from video_compressor.adapters.mp4 import mp4BoxVideoInfoAdapter
+from video_compressor.exceptions import InvalidVideoInput
+
+__author__ = "Lenselle Nicolas"
+__copyright__ = "Lenselle Nicolas"
+__license__ = "mit"
+
+
+def box(type, *payloads):
+    payload = b''.join(payloads)
+    return struct.pack('>I4s', 8 + len(payload), type) + payload
+
+
+def fullbox(type, payload, version=0, flags=0):
+    return box(type, struct.pack('>I', (version << 24) | flags), payload)
+
+
+def fragmented_mp4():
+    tkhd = fullbox(b'tkhd', struct.pack('>IIIII', 0, 0, 1, 0, 0) + bytes(52) + struct.pack('>II', 320 << 16, 240 << 16))
+    mdhd = fullbox(b'mdhd', struct.pack('>IIIIHH', 0, 0, 1000, 0, 0, 0))
+    hdlr = fullbox(b'hdlr', struct.pack('>I4s', 0, b'vide') + bytes(12) + b'video\0')
+    stbl = box(b'stbl', fullbox(b'stsd', struct.pack('>I', 0)), fullbox(b'stsz', struct.pack('>II', 0, 0)))
+    trak = box(b'trak', tkhd, box(b'mdia', mdhd, hdlr, box(b'minf', stbl)))
+    mvhd = fullbox(b'mvhd', struct.pack('>IIII', 0, 0, 1000, 0) + bytes(80))
+    mvex = box(b'mvex', fullbox(b'trex', struct.pack('>IIIII', 1, 1, 40, 0, 0)))
+    moov = box(b'moov', mvhd, trak, mvex)
+
+    fragments = b''
+    for _ in range(2):
+        tfhd = fullbox(b'tfhd', struct.pack('>I', 1))
+        trun = fullbox(b'trun', struct.pack('>IIII', 3, 100, 200, 300), flags=0x200)
+        fragments += box(b'moof', fullbox(b'mfhd', struct.pack('>I', 1)), box(b'traf', tfhd, trun))
+        fragments += box(b'mdat', bytes(600))
+
+    return box(b'ftyp', b'isom', struct.pack('>I', 0)) + moov + fragments
+
+
+def test_mp4_box_adapter_reads_sample():
+    info = vp.VideoInfo('./tests/sample.mp4', adapter=mp4BoxVideoInfoAdapter('./tests/sample.mp4'))
+
+    assert list(info.getResolution()) == [960, 540]
+    assert info.getVideoBitrate() == 2200634
+    assert info.getAudioBitrate() == 133274
+    assert info.getDurationInMicroseconds() == 4_871_533
+    assert info.getFramePerSeconds() == 30
+    assert info.getFrameRate() == Fraction(30000, 1001)
+    assert info.getSize() == 1507453
+    assert info.isFragmented() is False
+    assert info.volumedetect() is True
+    assert info.adapter.getTimescale() == 30000
+    assert info.adapter.getSampleCount() == 146
+
+
+def test_mp4_box_adapter_reads_fragments(tmp_path):
+    path = tmp_path / 'fragmented.mp4'
+    path.write_bytes(fragmented_mp4())
+
+    adapter = mp4BoxVideoInfoAdapter(str(path))
+
+    assert adapter.isFragmented() is True
+    assert adapter.movie.fragments == 2
+    assert adapter.getResolution() == (320, 240)
+    assert adapter.getSampleCount() == 6
+    assert adapter.getDurationInMicroseconds() == 240_000
+    assert adapter.getFramePerSeconds() == 25
+    assert adapter.getFrameRate() == 25
+    assert adapter.volumedetect() is False
+
+
+def test_mp4_box_adapter_invalid_input():
+    with pytest.raises(InvalidVideoInput):
+        vp.VideoInfo('./tests/corrupted-sample.mp4', adapter=mp4BoxVideoInfoAdapter('./tests/corrupted-sample.mp4'))
+
+    with pytest.raises(InvalidVideoInput):
+        mp4BoxVideoInfoAdapter('./tests/unexisting-sample.mp4').probe()
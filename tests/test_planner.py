@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+from fractions import Fraction
+
+from video_compressor.planner import ExportPlan, resolveScale
+
+__author__ = "Lenselle Nicolas"
+__copyright__ = "Lenselle Nicolas"
+__license__ = "mit"
+
+
+class StaticVideoInfo():
+
+    def __init__(self, resolution=(960, 540), frameRate=Fraction(30000, 1001)):
+        self.resolution = resolution
+        self.frameRate = frameRate
+
+    def getResolution(self):
+        return self.resolution
+
+    def getFrameRate(self):
+        return self.frameRate
+
+
+def plan(output='export.mp4', **options):
+    return ExportPlan({'input': 'video.mp4', **options}, StaticVideoInfo(), output=output)
+
+
+def test_resolve_scale():
+    assert resolveScale((640, -1), (960, 540)) == (640, 360)
+    assert resolveScale((-1, 270), (960, 540)) == (480, 270)
+    assert resolveScale((-1, -1), (960, 540)) == (960, 540)
+
+
+def test_noop_filters_are_dropped():
+    noop = plan(scale=(960, -1), crop_origin=(0, 0), crop_size=(960, 540), fps='30000/1001')
+
+    assert noop.options['scale'] is None
+    assert noop.options['crop_size'] is None
+    assert noop.options['fps'] is None
+    assert noop.copyVideo and noop.copyAudio
+
+    cropped = plan(scale=(480, 540), crop_origin=(0, 0), crop_size=(480, 540), fps=30)
+    assert cropped.options['scale'] is None
+    assert cropped.options['crop_size'] == (480, 540)
+    assert cropped.options['fps'] == 30
+    assert not cropped.copyVideo
+
+
+def test_decimation_before_scaling():
+    assert plan(scale=(480, -1), fps=24).filterOrder == ('crop', 'fps', 'scale')
+    assert plan(scale=(480, -1), fps=60).filterOrder == ('crop', 'scale', 'fps')
+
+
+def test_stream_copy():
+    muted = plan(mute=True)
+    assert muted.copyVideo and not muted.copyAudio
+
+    encoded = plan(bitrate='1M')
+    assert not encoded.copyVideo and encoded.copyAudio
+
+    assert not plan(quality='low').copyVideo
+    assert not plan(output='export.webm').copyVideo
+    assert not plan(output='export.webm').copyAudio
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import asyncio
+import threading
+
+import pytest
+
+from video_compressor.adapters.runner import ProcessRunner
+from video_compressor.exceptions import ProcessError, ProcessTimeoutError
+
+__author__ = "Lenselle Nicolas"
+__copyright__ = "Lenselle Nicolas"
+__license__ = "mit"
+
+
+def python(code):
+    return [sys.executable, '-c', code]
+
+
+def test_run_collects_stdout_log_and_rusage():
+    runner = ProcessRunner()
+    result = runner.run(python('import sys; print("out"); print("err", file=sys.stderr)'))
+
+    assert result.text == 'out\n'
+    assert result.log == 'err'
+    assert result.returncode == 0
+    assert result.cpu_time >= 0
+    assert result.max_rss > 0
+    assert runner.stats()['processes'] == 1
+
+
+def test_run_raises_on_exit_code():
+    runner = ProcessRunner()
+
+    with pytest.raises(ProcessError) as error:
+        runner.run(python('import sys; sys.exit("broken input")'))
+    assert error.value.result.returncode == 1
+    assert 'broken input' in str(error.value)
+
+    assert runner.run(python('import sys; sys.exit(3)'), check=False).returncode == 3
+    assert runner.stats()['failures'] == 2
+
+
+def test_log_is_bounded():
+    code = 'import sys\nfor i in range(10000): print("line", i, file=sys.stderr)'
+    result = ProcessRunner(log_lines=10).run(python(code))
+
+    assert result.log.splitlines() == [f'line {i}' for i in range(9990, 10000)]
+
+
+def test_log_lines_are_streamed():
+    lines = []
+    ProcessRunner(log_lines=1).run(python('import sys; print("a\\rb", file=sys.stderr)'), on_log=lines.append)
+
+    assert lines == ['a', 'b']
+
+
+def test_timeout_kills_the_process():
+    with pytest.raises(ProcessTimeoutError):
+        ProcessRunner(timeout=0.2).run(python('import time; time.sleep(10)'))
+
+
+def test_readers():
+    runner = ProcessRunner()
+
+    assert list(runner.lines(python('print(1); print(2)'))) == ['1\n', '2\n']
+    assert b''.join(runner.chunks('cat', source=[b'a', b'b'])) == b'ab'
+
+    chunks = runner.chunks(python('import sys\nwhile True: sys.stdout.write("x" * 4096)'))
+    next(chunks)
+    chunks.close()
+    assert runner.stats()['processes'] == 3
+
+
+def test_run_async_kills_on_cancel():
+    runner = ProcessRunner()
+
+    async def cancel():
+        task = asyncio.ensure_future(runner.runAsync(python('import time; time.sleep(10)')))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        await task
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(cancel())
+    assert runner.stats()['processes'] == 1
+
+
+def test_run_async_collects_rusage_without_threads():
+    runner = ProcessRunner()
+
+    async def run():
+        tasks = [asyncio.ensure_future(runner.runAsync(python('import time; time.sleep(0.5); print("out")'))) for i in range(20)]
+        await asyncio.sleep(0.2)
+        threads = threading.active_count()
+        return await asyncio.gather(*tasks), threads
+
+    results, threads = asyncio.run(run())
+    assert all(result.text == 'out\n' and result.cpu_time >= 0 and result.max_rss > 0 for result in results)
+    assert runner.stats()['processes'] == 20
+    if hasattr(os, 'pidfd_open'):
+        assert threads == threading.active_count()
+
+
+def test_async_readers_and_timeout():
+    runner = ProcessRunner()
+
+    async def read():
+        return b''.join([chunk async for chunk in runner.chunksAsync('cat', source=[b'a', b'b'])])
+
+    assert asyncio.run(read()) == b'ab'
+    with pytest.raises(ProcessTimeoutError):
+        asyncio.run(runner.runAsync(python('import time; time.sleep(10)'), timeout=0.2))
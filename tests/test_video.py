@@ -66,6 +66,25 @@ def test_error_with_invalid_input():
         VideoInfo('./tests/unexisting-sample.mp4')
 
 
+def test_integrity_levels():
+
+    VideoInfo('./tests/corrupted-sample.mp4', integrity='none')
+    VideoInfo('./tests/sample.mp4', integrity='sampled', integrity_samples=3)
+
+    with pytest.raises(InvalidVideoInput):
+        VideoInfo('./tests/corrupted-sample.mp4', integrity='header')
+
+    with pytest.raises(ValueError):
+        VideoInfo('./tests/sample.mp4', integrity='partial')
+
+
+def test_deferred_integrity():
+
+    video = VideoInfo('./tests/corrupted-sample.mp4', defer_integrity=True)
+    with pytest.raises(InvalidVideoInput):
+        video.checkIntegrity(level='header')
+
+
 def test_error_with_invalid_ouput():
     pass
 
@@ -250,6 +269,34 @@ def test_slice_video_by_1_seconds(temp):
     slices = video.slice(temp('sample-slice025.mp4'), stepInMilliseconds=2000)
     assert slices.getDurationInMicroseconds() == video.info.getDurationInMicroseconds()
 
+def test_export_chunked(temp):
+
+    commands = []
+    runner = vp.ProcessRunner(on_exit=lambda result: commands.append(result.argv))
+    video = VideoCompressor(input='./tests/sample.mp4', runner=runner)
+    video.scale(640).bitrate('1M').exportChunked(temp('sample-chunked.mp4'), chunkInMilliseconds=1500, max_workers=4)
+    assert not [argv for argv in commands if 'null' in argv]
+
+    chunked = VideoInfo(temp('sample-chunked.mp4'))
+    assert chunked.getDurationInMicroseconds() == video.info.getDurationInMicroseconds()
+    assert list(chunked.getResolution())[0] == 640
+    assert chunked.hasAudio() is True
+
+
+def test_slice_video_with_segment_muxer(temp):
+
+    video = VideoCompressor(input='./tests/sample.mp4')
+
+    slices = video.slice(temp('sample-segment.mp4'), stepInMilliseconds=1000, segment=True, copy=True)
+    assert len(slices) > 1
+    assert slices.getDurationInMicroseconds() == video.info.getDurationInMicroseconds()
+    assert os.path.exists(temp('sample-segment-0.mp4'))
+
+    slices = video.scale(320).slice(temp('sample-segment-scaled.mp4'), stepInMilliseconds=2000, segment=True)
+    assert slices.getDurationInMicroseconds() == video.info.getDurationInMicroseconds()
+    assert list(slices[0].getResolution())[0] == 320
+
+
 def test_export_video_collection(temp):
 
     settings = [
@@ -273,6 +320,93 @@ def test_export_video_collection(temp):
     assert VideoInfo(temp(f'sample@sm+low.mp4')).getSize() < VideoInfo(temp(f'sample@sm.mp4')).getSize()
 
 
+def test_export_video_collection_single_decode(temp):
+
+    settings = [
+        {'codec_preset': 'h264WebVBR', 'scale':[480, -1], 'bitrate': 200_000, 'fps': 24, 'mute': True, 'suffix':'@sm'},
+        {'scale':[640, -1], 'bitrate': 1_000_000, 'fps': 24, 'suffix':'@md'},
+        {'scale':[960, -1], 'bitrate': 2_000_000, 'fps': 24, 'suffix':'@lg'},
+    ]
+
+    video = VideoCompressor('./tests/sample.mp4')
+    renditions = list(video.exportCollection(temp('sample.mp4'), settings, single_decode=True))
+    assert len(renditions) == len(settings)
+
+    for setting in settings:
+        export = VideoInfo(temp(f"sample{setting['suffix']}.mp4"))
+        assert list(export.getResolution())[0] == setting['scale'][0]
+        assert export.getFramePerSeconds() == setting['fps']
+        assert export.getVideoBitrate() < setting['bitrate']
+        assert export.hasAudio() is not setting.get('mute', False)
+
+
+class TouchCompressorAdapter():
+
+    def __init__(self, scale=None, **options):
+        self.scale = scale
+
+    def export(self, output):
+        if self.scale is None:
+            raise RuntimeError(output)
+        with open(output, 'w') as f:
+            f.write(str(self.scale))
+
+
+@pytest.mark.parametrize('executor', ['thread', 'process'])
+def test_export_video_collection_parallel(temp, executor):
+
+    settings = [
+        {'scale': [480, -1], 'suffix': '@sm'},
+        {'scale': None, 'suffix': '@broken'},
+        {'scale': [640, -1], 'suffix': '@md'},
+    ]
+
+    video = vp.VideoCompressor('./tests/sample.mp4', adapter=TouchCompressorAdapter)
+    results = list(video.exportCollectionParallel(temp('sample.mp4'), settings, max_workers=2, executor=executor))
+
+    assert len(results) == 3
+    errors = {rendition.outputPath('sample.mp4'): error for rendition, error in results}
+    assert isinstance(errors['sample@broken.mp4'], RuntimeError)
+    assert errors['sample@sm.mp4'] is None
+    assert os.path.exists(temp('sample@sm.mp4'))
+    assert os.path.exists(temp('sample@md.mp4'))
+
+
+def test_two_pass_encoding_reuses_first_pass(temp):
+
+    video = VideoCompressor('./tests/sample.mp4', passlog_dir=temp('passlogs')).codecPass(2).scale(640).fps(24)
+
+    video.bitrate('500k').export(temp('sample-500k.mp4'))
+    passlogs = os.listdir(temp('passlogs'))
+    video.bitrate('300k').codecPreset('h264WebVBR').export(temp('sample-300k.mp4'))
+    video.bitrate('400k').export(temp('sample-400k.mp4'))
+
+    assert len(os.listdir(temp('passlogs'))) == 2 * len(passlogs)
+    assert VideoInfo(temp('sample-500k.mp4')).getVideoBitrate() < 550_000
+    assert VideoInfo(temp('sample-300k.mp4')).getVideoBitrate() < 330_000
+
+
+def test_two_pass_async_exports_share_first_pass(temp):
+    import asyncio
+
+    os.makedirs(temp('passlogs'))
+    with open(temp('passlogs/stale-0.log'), 'w') as f:
+        f.write('stale')
+    os.utime(temp('passlogs/stale-0.log'), (0, 0))
+
+    commands = []
+    runner = vp.ProcessRunner(on_exit=lambda result: commands.append(result.argv))
+    video = VideoCompressor('./tests/sample.mp4', passlog_dir=temp('passlogs'), runner=runner)
+    video = video.codecPass(2).scale(320).bitrate('300k')
+
+    async def export():
+        await asyncio.gather(*[video.exportAsync(temp(f'sample-async-{i}.mp4')) for i in range(4)])
+
+    asyncio.run(export())
+    assert len([argv for argv in commands if '-pass' in argv and argv[argv.index('-pass') + 1] == '1']) == 1
+    assert not os.path.exists(temp('passlogs/stale-0.log'))
+
+
 def test_hs264_webpreset(temp):
 
     h264WebPreset = temp('webh264.mp4')
@@ -293,6 +427,21 @@ def test_export_video_with_height_not_divisable_by_two(temp):
     videoCrop.scale(480, -1).export(temp('video-crop2.mp4'))
     
 
+def test_probe_video_collection():
+
+    videos = ['./tests/sample.mp4', './tests/corrupted-sample.mp4', './tests/mute-sample.mp4']
+    collection = vp.VideoInfoCollection.probe(videos, max_workers=2, integrity='header')
+
+    assert [video.path for video in collection] == ['./tests/sample.mp4', './tests/mute-sample.mp4']
+    assert [path for path, error in collection.errors] == ['./tests/corrupted-sample.mp4']
+    assert isinstance(collection.errors[0][1], InvalidVideoInput)
+    assert collection.getSize() == 1507453 + 1423736
+    assert collection.getMeanVideoBitrate() > 0
+
+    with pytest.raises(InvalidVideoInput):
+        vp.VideoInfoCollection(videos, integrity='header')
+
+
 def test_fragment_a_video(temp):
 
     video = VideoCompressor('./tests/sample.mp4')
@@ -303,6 +452,11 @@ def test_fragment_a_video(temp):
     video.fragment(sample_fragmented)
     assert VideoInfo(sample_fragmented).isFragmented() is True
 
+    updates = []
+    video.fragment(temp(filename='sample-fragment-progress.mp4'), progress=updates.append)
+    assert updates[-1].done is True
+    assert updates[-1].percent == 100
+
 # targetSize=$(( 25 * 1000 * 1000 * 8 )) # 25MB in bits
 # length=`ffprobe -v error -show_entries format=duration -of default=noprint_wrappers=1:nokey=1 input.mp4`
 # length_round_up=$(( ${length%.*} + 1 ))
@@ -311,3 +465,318 @@ def test_fragment_a_video(temp):
 # video_bitrate=$(( $total_bitrate - $audio_bitrate ))
 # ffmpeg -i input.mp4 -b:v $video_bitrate -maxrate:v $video_bitrate
 # -bufsize:v $(( $targetSize / 20 )) -b:a $audio_bitrate output.mp4
+
+
+def test_probe_metadata_snapshot():
+    from video_compressor.adapters.ffmpeg import ffprobeMetadata
+
+    metadata = ffprobeMetadata.fromJSON('''{
+        "streams": [
+            {"codec_type": "video", "width": 960, "height": 540, "bit_rate": "2200634",
+             "duration": "4.871533", "r_frame_rate": "30000/1001"},
+            {"codec_type": "audio", "bit_rate": "133274"}
+        ],
+        "format": {"duration": "4.900000", "size": "1507453"}
+    }''')
+
+    assert (metadata.width, metadata.height) == (960, 540)
+    assert metadata.videoBitrate == 2200634
+    assert metadata.audioBitrate == 133274
+    assert metadata.duration == 4.871533
+    assert round(metadata.frameRate) == 30
+
+    with pytest.raises(InvalidVideoInput):
+        ffprobeMetadata.fromJSON('')
+
+
+def test_analyze_audio():
+    pytest.importorskip('numpy')
+
+    assert VideoInfo('./tests/sample.mp4').hasAudio() is True
+    assert VideoInfo('./tests/mute-sample.mp4').hasAudio() is False
+
+    analysis = VideoInfo('./tests/sample.mp4').analyzeAudio(window_ms=100, waveform_points=10)
+    assert len(analysis.rms) == 49
+    assert len(analysis.waveform) == 10
+    assert analysis.isSilent() is False
+
+    assert VideoInfo('./tests/mute-sample.mp4').analyzeAudio().isSilent() is True
+
+
+def test_audio_analyzer_silence_detection():
+    np = pytest.importorskip('numpy')
+    from video_compressor.audio import AudioAnalyzer
+
+    tone = (np.sin(np.arange(8000) / 5) * 16000).astype('<i2')
+    silence = np.zeros(8000, dtype='<i2')
+    pcm = np.concatenate([tone, silence, tone]).tobytes()
+
+    analyzer = AudioAnalyzer(sample_rate=8000, window_ms=100, silence_duration_ms=500)
+    analysis = analyzer.analyze(pcm[i:i + 999] for i in range(0, len(pcm), 999))
+
+    assert len(analysis.rms) == 30
+    assert analysis.silences == [(1000, 2000)]
+    assert analysis.peak.max() > 0.4
+
+
+def test_async_video_info():
+    import asyncio
+
+    async def probe():
+        semaphore = asyncio.Semaphore(1)
+        return await asyncio.gather(
+            vp.AsyncVideoInfo.open('./tests/sample.mp4', semaphore=semaphore),
+            vp.AsyncVideoInfo.open('./tests/mute-sample.mp4', semaphore=semaphore),
+        )
+
+    sample, mute = asyncio.run(probe())
+    assert list(sample.getResolution()) == [960, 540]
+    assert sample.hasAudio() is True
+    assert mute.hasAudio() is False
+
+    with pytest.raises(InvalidVideoInput):
+        asyncio.run(vp.AsyncVideoInfo.open('./tests/corrupted-sample.mp4'))
+
+
+def test_async_export(temp):
+    import asyncio
+
+    video = VideoCompressor('./tests/sample.mp4').scale(96, 54)
+
+    async def export():
+        semaphore = asyncio.Semaphore(2)
+        await asyncio.gather(*(
+            video.exportAsync(temp(f'sample-async-{i}.mp4'), semaphore=semaphore) for i in range(3)
+        ))
+
+    asyncio.run(export())
+    for i in range(3):
+        assert list(VideoInfo(temp(f'sample-async-{i}.mp4')).getResolution()) == [96, 54]
+
+    async def cancel():
+        task = asyncio.ensure_future(video.exportAsync(temp('sample-cancelled.mp4')))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        await task
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(cancel())
+
+
+def test_commands_are_argv_lists(temp):
+    from video_compressor.adapters.ffmpeg import ffmpegCmdBuilder
+
+    ffmpeg = ffmpegCmdBuilder(input="it's a clip.mp4", bin='ffmpeg', scale=(640, -1), bitrate='1M')
+    assert ffmpeg.export('out put.mp4') == [
+        'ffmpeg', '-y', '-i', "it's a clip.mp4", '-b:v', '1M', '-vf', 'scale=640:trunc(ow/a/2)*2', 'out put.mp4'
+    ]
+
+    shutil.copy('./tests/sample.mp4', temp("it's a clip.mp4"))
+    VideoCompressor(temp("it's a clip.mp4")).scale(320).export(temp('out put.mp4'))
+    assert VideoInfo(temp('out put.mp4')).getResolution() == (320, 180)
+
+
+def test_parse_ffmpeg_progress():
+    from video_compressor.adapters.ffmpeg import parse_progress
+
+    lines = [
+        'frame=0\n', 'fps=0.00\n', 'bitrate=N/A\n', 'out_time_us=N/A\n', 'speed=N/A\n', 'progress=continue\n',
+        'frame=60\n', 'fps=30.00\n', 'bitrate= 800.5kbits/s\n', 'out_time_us=2000000\n', 'speed=2.0x\n', 'progress=continue\n',
+        'frame=120\n', 'fps=30.00\n', 'bitrate= 810.0kbits/s\n', 'out_time_us=4000000\n', 'speed=2.0x\n', 'progress=end\n',
+    ]
+    start, middle, end = parse_progress(lines, durationInMicroseconds=4_000_000)
+
+    assert start.out_time is None and start.eta is None and start.bitrate is None
+    assert middle.frame == 60
+    assert middle.bitrate == 800500
+    assert middle.percent == 50.0
+    assert middle.eta == 1.0
+    assert end.done is True and end.eta == 0.0
+
+
+def test_export_with_progress(temp):
+    updates = []
+    commands = []
+    runner = vp.ProcessRunner(on_exit=lambda result: commands.append(result.argv[0]))
+    video = VideoCompressor('./tests/sample.mp4', runner=runner).scale(96, 54)
+    video.export(temp('sample-progress.mp4'), progress=updates.append)
+
+    assert updates[-1].done is True
+    assert updates[-1].frame > 0
+    assert commands == ['ffprobe', 'ffmpeg']
+
+    updates = list(video.exportProgress(temp('sample-progress-iter.mp4')))
+    assert updates[-1].percent == 100.0
+
+
+def test_export_stream_from_pipe(temp):
+    import io
+    import asyncio
+
+    with open('./tests/sample.mp4', 'rb') as source:
+        output = io.BytesIO()
+        VideoCompressor(source).scale(320).exportStream(output)
+
+    with open(temp('streamed.mp4'), 'wb') as f:
+        f.write(output.getvalue())
+
+    from video_compressor.adapters.mp4 import mp4BoxVideoInfoAdapter
+    info = vp.VideoInfo(temp('streamed.mp4'), adapter=mp4BoxVideoInfoAdapter(temp('streamed.mp4')))
+    assert info.isFragmented()
+    assert info.getResolution() == (320, 180)
+
+    def chunks():
+        with open('./tests/sample.mp4', 'rb') as f:
+            yield from iter(lambda: f.read(16 * 1024), b'')
+
+    async def collect():
+        return b''.join([chunk async for chunk in VideoCompressor(chunks()).mute(True).exportStreamAsync()])
+
+    assert len(asyncio.run(collect())) > 0
+
+
+def test_export_from_pipe(temp):
+
+    with open('./tests/sample.mp4', 'rb') as source:
+        VideoCompressor(source).scale(320).export(temp('piped.mp4'))
+    assert VideoInfo(temp('piped.mp4')).getResolution() == (320, 180)
+
+    with open('./tests/sample.mp4', 'rb') as source:
+        with pytest.raises(InvalidVideoInput):
+            VideoCompressor(source).slice(temp('piped-slice.mp4'))
+
+
+def test_build_content_adaptive_ladder():
+
+    commands = []
+    runner = vp.ProcessRunner(on_exit=lambda result: commands.append(result.argv))
+    video = VideoCompressor('./tests/sample.mp4', runner=runner)
+    ladder = video.buildLadder(widths=[480, 640, 1280], samples=2, sampleInMilliseconds=1000)
+    assert not [argv for argv in commands if 'null' in argv]
+
+    assert [setting['scale'] for setting in ladder] == [[480, -1], [640, -1], [960, -1]]
+    assert [setting['suffix'] for setting in ladder] == ['@480w', '@640w', '@960w']
+    assert all(setting['bitrate'].endswith(('k', 'M')) for setting in ladder)
+
+    capped = VideoCompressor('./tests/sample.mp4').crop((0, 0), (600, 540))
+    assert max(setting['scale'][0] for setting in capped.buildLadder(samples=1)) == 600
+
+
+def test_export_target_size(temp):
+
+    video = VideoCompressor('./tests/sample.mp4').scale(640).targetSize(300_000)
+    assert video.mute(True).targetBitrate() > video.targetBitrate()
+
+    prediction = video.predictExport(samples=2, sampleInMilliseconds=1000)
+    assert prediction['size'] > 0 and prediction['seconds'] > 0
+
+    commands = []
+    runner = vp.ProcessRunner(on_exit=lambda result: commands.append(result.argv))
+    VideoCompressor('./tests/sample.mp4', runner=runner).scale(640).targetSize(300_000).export(temp('sample-300kB.mp4'))
+    assert 200_000 < os.path.getsize(temp('sample-300kB.mp4')) <= 300_000
+    assert ['-b:a', '128000'] == commands[-1][commands[-1].index('-b:a'):][:2]
+
+    import asyncio
+    asyncio.run(video.exportAsync(temp('sample-300kB-async.mp4')))
+    assert 200_000 < os.path.getsize(temp('sample-300kB-async.mp4')) <= 300_000
+
+    video.exportChunked(temp('sample-300kB-chunked.mp4'), chunkInMilliseconds=1500)
+    assert 150_000 < os.path.getsize(temp('sample-300kB-chunked.mp4')) <= 300_000
+
+
+def test_quality_measure_and_crf_search():
+    from video_compressor.quality import QualityMeter
+
+    video = VideoCompressor('./tests/sample.mp4').scale(640)
+
+    with QualityMeter(video, samples=2, sampleInMilliseconds=500) as meter:
+        high = video.crf(18).measureQuality(meter=meter)
+        low = video.crf(38).measureQuality(meter=meter)
+        assert 0 < low['ssim'] < high['ssim'] <= 1
+        assert low['psnr'] < high['psnr']
+
+        searched = video.searchCrf(high['ssim'], meter=meter)
+        assert searched.options()['crf'] >= 18
+
+
+def test_thumbnails_sprite_and_webvtt(temp):
+
+    commands = []
+    runner = vp.ProcessRunner(on_exit=lambda result: commands.append(result.argv[0]))
+    video = VideoCompressor('./tests/sample.mp4', runner=runner)
+    result = video.thumbnails(temp('thumb.jpg'), timesInMilliseconds=[0, 1200, 3300], width=96, exact=True)
+    assert commands == ['ffprobe', 'ffmpeg']
+
+    assert [time for path, time in result['thumbnails']] == [0, 1201, 3303]
+    assert all(os.path.exists(path) for path, time in result['thumbnails'])
+    assert os.path.exists(result['sprite'])
+
+    with open(result['vtt']) as f:
+        vtt = f.read()
+    assert vtt.startswith('WEBVTT')
+    assert '00:00:01.201 --> 00:00:03.303\nthumb-sprite.jpg#xywh=96,0,96,54' in vtt
+
+
+def test_numpy_frame_iterator():
+    pytest.importorskip('numpy')
+
+    video = VideoCompressor('./tests/sample.mp4').scale(320).fps(10)
+    frames = [frame.copy() for frame in video.frames(stride=2, ring=3)]
+
+    assert len(frames) == 25
+    assert frames[0].shape == (180, 320, 3)
+    assert len({id(frame) for frame in video.frames(ring=3)}) == 3
+
+    gray = next(iter(VideoInfo('./tests/sample.mp4').frames(pix_fmt='gray')))
+    assert gray.shape == (540, 960)
+
+
+@pytest.mark.parametrize('format, manifest', [('hls', 'master.m3u8'), ('dash', 'manifest.mpd')])
+def test_package_adaptive_stream(temp, format, manifest):
+
+    settings = [{'scale': [320, -1], 'bitrate': '200k'}, {'scale': [640, -1], 'bitrate': '500k', 'fps': 24}]
+    video = VideoCompressor('./tests/sample.mp4')
+    path = video.package(temp(format), settings, format=format, segmentInMilliseconds=2000)
+
+    assert path == temp(f'{format}/{manifest}')
+    with open(path) as f:
+        content = f.read()
+    assert '320x180' in content or 'width="320"' in content
+    assert '640x360' in content or 'width="640"' in content
+
+
+def test_probe_cache_through_video_info(temp):
+
+    cache = vp.ProbeCache(temp('probe.sqlite'))
+    for i in range(3):
+        VideoInfo('./tests/sample.mp4', probe_cache=cache, integrity='header').getResolution()
+
+    assert cache.stats() == {'hits': 4, 'misses': 2, 'entries': 2}
+
+
+def test_slice_seeking_with_packet_index(temp):
+
+    cache = vp.ProbeCache(temp('probe.sqlite'))
+    video = VideoCompressor('./tests/sample.mp4', probe_cache=cache)
+
+    keyframes = video.info.getPacketIndex().keyframes
+    assert keyframes[0] == 0 and len(keyframes) > 1
+    assert os.listdir(temp('index'))
+
+    videos = video.slice(temp('sample.mp4'), stepInMilliseconds=2000, index=True)
+    assert len(videos) == 3
+    assert videos[1].getDurationInMilliseconds() == pytest.approx(2000, abs=40)
+
+
+def test_remux_when_no_transform_is_needed(temp):
+
+    video = VideoCompressor('./tests/sample.mp4')
+    plan = video.mute(True).scale(960, -1).plan(temp('sample-remux.mp4'))
+    assert plan.options['scale'] is None
+    assert plan.copyVideo is True
+
+    video.mute(True).scale(960, -1).export(temp('sample-remux.mp4'))
+    remux = VideoInfo(temp('sample-remux.mp4'))
+    assert list(remux.getResolution()) == [960, 540]
+    assert abs(remux.getVideoBitrate() - VideoInfo('./tests/sample.mp4').getVideoBitrate()) < 22000
+    assert remux.hasAudio() is False